@@ -0,0 +1,112 @@
+import argparse
+import multiprocessing
+import os
+
+from crew import reference_data
+from crew.batch import batch_concurrency
+from crew.ledger import Ledger
+from crew.llm_cache import get_llm_cache
+from crew.pdf import extract_pdf, page_count
+from crew.scheduler import DOCS_DIR, KINDS, InvoiceGroup, group_concurrency, group_priority, load_workbooks, run_groups, scan
+from crew.telemetry import disable_crewai_telemetry
+from crew.token_report import format_tool_report
+from crew.tracing import format_trace_summary
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def rebate_matcher(llm=None):
+    import rebates_matching
+
+    agent = rebates_matching.Agent(llm)
+    return lambda path, text: agent.match(text)
+
+
+def event_matcher(llm=None):
+    import events_matching
+
+    agent = events_matching.Agent(llm)
+    # Very large invoices are not extracted up front, they are streamed page by page; the page
+    # workers are spawned since the scheduler runs the matching in threads
+    spawn = multiprocessing.get_context("spawn")
+    return lambda path, text: agent.match_pdf(path, spawn) if text is None else agent.match(text)
+
+
+MATCHERS = {"rebates": rebate_matcher, "events": event_matcher}
+
+
+def plan(docs_dir: str = DOCS_DIR) -> dict:
+    """
+    Scans docs/*/ and returns, for each kind, the invoices still to be matched against its current
+    workbooks: {kind: (ledger, reference version, {path: sha256})}.
+    """
+    invoices, unclassified = scan(docs_dir)
+    for path in unclassified:
+        print(f"Skipped {path}: neither a rebate nor an event invoice")
+
+    pending = {}
+    for kind, paths in invoices.items():
+        ledger = Ledger(kind)
+        version = reference_data.reference_version(KINDS[kind][1])
+        pending[kind] = (ledger, version, ledger.pending(paths, version))
+        print(f"{len(pending[kind][2])} of {len(paths)} {kind} invoices to process")
+    return pending
+
+
+def build_groups(pending: dict, workers: int, llm=None) -> list:
+    """
+    One group per set of reference workbooks, with its agent, priority and concurrency.
+    Agents are only built for the kinds that have invoices to match.
+    """
+    large_pdf_pages = int(os.getenv("LARGE_PDF_PAGES", "50"))
+    groups = []
+    for kind, (_, _, invoices) in pending.items():
+        if not invoices:
+            continue
+        stream = {path for path in invoices if kind == "events" and page_count(path) >= large_pdf_pages}
+        groups.append(InvoiceGroup(
+            kind=kind,
+            invoices=list(invoices),
+            match=MATCHERS[kind](llm),
+            prepare=lambda kind=kind: load_workbooks(kind),
+            priority=group_priority(kind),
+            concurrency=group_concurrency(kind, workers),
+            stream=stream,
+        ))
+    return groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Matches the rebate and event invoices of docs/*/ in one run")
+    parser.add_argument("--docs", default=DOCS_DIR, help="Folder whose sub folders hold the invoices")
+    parser.add_argument("--workers", type=int, default=batch_concurrency(), help="Invoices matched at the same time, BATCH_CONCURRENCY by default")
+    parser.add_argument("--dry-run", action="store_true", help="Only print how many invoices of each kind are pending")
+    args = parser.parse_args()
+
+    disable_crewai_telemetry()
+    pending = plan(args.docs)
+    if args.dry_run or not any(invoices for _, _, invoices in pending.values()):
+        raise SystemExit(0)
+
+    # Invoices sharing workbooks are one group: the workbooks are loaded once, then the groups share the workers
+    groups = build_groups(pending, args.workers)
+    results = {kind: [] for kind in pending}
+    for group, pdf_file, report, error in run_groups(groups, extract_pdf, args.workers):
+        ledger, version, invoices = pending[group.kind]
+        ledger.record(pdf_file, invoices[pdf_file], version, report.model_dump(mode="json") if error is None else None, error)
+        if error is not None:
+            print(f"Error processing {group.kind} invoice {pdf_file}: {error}")
+            continue
+        print(f"Processed {group.kind} invoice: {pdf_file}")
+        results[group.kind].append(report.model_dump_json(indent=2))
+
+    for kind, reports in results.items():
+        if reports:
+            print(f"\n\n####### {kind.upper()} RESULTS #######\n")
+            for r in reports:
+                print(r)
+
+    print(f"\nLLM cache: {get_llm_cache().stats()}")
+    print(f"\nTool output tokens:\n{format_tool_report()}")
+    print(f"\nTrace summary (spans in results/traces.jsonl):\n{format_trace_summary()}")
@@ -0,0 +1,50 @@
+"""
+Minimal text-only PDF writer for the synthetic invoices (no extra dependency, PyPDF2 only reads).
+"""
+
+LINE_HEIGHT = 12
+LINES_PER_PAGE = 60
+
+
+def _escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, lines: list, lines_per_page: int = LINES_PER_PAGE):
+    """
+    Writes the lines as a PDF, one text line per line and lines_per_page lines per page,
+    in Helvetica so PyPDF2 extracts the same text back.
+    """
+    pages = [lines[start:start + lines_per_page] for start in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    font_id = 1
+    pages_id = 3 + 2 * len(pages)
+    objects.append(None)  # placeholder so object numbers below are known up front
+    page_ids = []
+    for page in pages:
+        text = " ".join(f"({_escape(line)}) '" for line in page)
+        stream = f"BT /F1 10 Tf 40 800 Td {LINE_HEIGHT} TL {text} ET".encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R /Resources << /Font << /F1 %d 0 R >> >> >>"
+            % (pages_id, content_id, font_id)
+        )
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids)))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 2 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    with open(path, "wb") as file:
+        file.write(output)
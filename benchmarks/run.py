@@ -0,0 +1,324 @@
+"""
+Benchmark of the invoice matching pipeline on synthetic data.
+
+Generates the reference workbooks and invoices at the requested scale in a temporary folder, runs every
+stage against a local stub LLM server (no network, no token cost) and reports per-stage timings,
+invoices/sec and peak RSS. Results are saved under benchmarks/results/ to compare commits:
+
+    python -m benchmarks.run --rows 10000 --lines 100 --invoices 20
+    python -m benchmarks.run --rows 10000 --lines 100 --invoices 20 --compare latest
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from benchmarks import synthetic
+from benchmarks.stub_llm import StubLLMServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+class Stages:
+    """
+    Collects the wall time of each stage and the number of items it processed.
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    @contextlib.contextmanager
+    def time(self, name: str, count: int = 1):
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        self.results[name] = {
+            "seconds": round(seconds, 4),
+            "count": count,
+            "ms_per_item": round(1000 * seconds / max(count, 1), 4),
+        }
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss * scale / 2 ** 20, 1)
+
+
+def git_commit() -> dict:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    return {"sha": git("rev-parse", "--short", "HEAD") or "unknown", "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def load_workbooks():
+    from crew import reference_data
+    for loader in (reference_data.mapping, reference_data.net_receipts, reference_data.snowflake,
+                   reference_data.tipps, reference_data.mapping_events):
+        loader()
+
+
+def rebate_script(fields, report) -> list:
+    """Scripted ReAct run of the rebate crew: the three tools, then the final report."""
+    from crew import reference_data
+
+    net_receipt = reference_data.net_receipts().first(fields.invoice_month.lower())[report.category]
+    return [
+        {"tool_calls": [{"name": "query_mapping", "arguments": {"mdf_number": fields.mdf_number}}]},
+        {"tool_calls": [{"name": "query_net_receipts", "arguments": {"rebate_category": report.category, "date_month": fields.invoice_month}}]},
+        {"tool_calls": [{"name": "calculate_rebate_value", "arguments": {"net_receipt_category_value": float(net_receipt), "invoice_percentage": fields.percentage}}]},
+        {"content": report.model_dump_json()},
+    ]
+
+
+def event_script(report: dict) -> list:
+    """Scripted ReAct run of the event crew: batch lookups, mapping, then the final report."""
+    lines = report["invoice_data"]
+    return [
+        {"tool_calls": [{"name": "query_snowflake_batch", "arguments": {"asins": [line["asin"] for line in lines]}}]},
+        {"tool_calls": [{"name": "query_tipps_batch", "arguments": {"eans": [line["ean"] for line in lines]}}]},
+        {"tool_calls": [{"name": "query_mapping_events", "arguments": {"invoice_data": {"mdf_number": report["agreement_id"]}}}]},
+        {"content": json.dumps({key: value for key, value in report.items() if key != "unparsed_lines"})},
+    ]
+
+
+def stub_llm(stub: StubLLMServer):
+    from crewai import LLM
+    # CrewAI's native OpenAI provider speaks the same chat completions protocol as the Azure deployment
+    return LLM(model="openai/gpt-4o", base_url=stub.url, api_key="benchmark", temperature=0)
+
+
+def run(args) -> dict:
+    # Budgets of the real deployment would throttle the stub, the limiter itself is still exercised
+    os.environ["LLM_RPM"] = "1000000"
+    os.environ["LLM_TPM"] = "1000000000"
+    os.environ["BATCH_CONCURRENCY"] = str(args.concurrency)
+
+    from crew import reference_data, snapshot
+    from crew.batch import run_batch
+    from crew.events_engine import match_event_invoice
+    from crew.pdf import extract_pdf
+    from crew.rebate_engine import extract_fields, match_rebates, match_rebate_invoice
+    from crew.telemetry import disable_crewai_telemetry
+    from crew.tools import (query_mapping, query_net_receipts, query_snowflake_batch, query_tipps_batch,
+                            query_mapping_events)
+    import events_matching
+    import rebates_matching
+
+    disable_crewai_telemetry()
+    stages = Stages()
+    rng = random.Random(args.seed)
+
+    with stages.time("generate", 5 + 2 * args.invoices):
+        synthetic.write_workbooks(".", args.rows, args.seed)
+        rebate_pdfs = synthetic.write_rebate_invoices(".", args.invoices, args.rows, args.seed)
+        event_pdfs = synthetic.write_event_invoices(".", args.invoices, args.rows, args.lines, args.seed)
+    pdfs = rebate_pdfs + event_pdfs
+
+    # Reference workbooks: first load parses the xlsx and writes the Arrow snapshots, then snapshots only
+    with stages.time("workbook_load_cold", 5):
+        load_workbooks()
+    reference_data.clear_cache()
+    with stages.time("workbook_load_snapshot", 5):
+        load_workbooks()
+    with stages.time("snapshot_compile_noop", 5):
+        snapshot.compile_snapshots()
+
+    # PDF extraction without cache, then the sha256 text cache cold and warm
+    with stages.time("pdf_extract", len(pdfs)):
+        texts = {path: extract_pdf(path, cache_dir=None) for path in pdfs}
+    with stages.time("pdf_extract_cache_fill", len(pdfs)):
+        for path in pdfs:
+            extract_pdf(path)
+    with stages.time("pdf_extract_cache_hit", len(pdfs)):
+        for path in pdfs:
+            extract_pdf(path)
+
+    # Tool lookups as the crew calls them (JSON in, JSON out)
+    asins = [synthetic.asin(rng.randrange(args.rows)) for _ in range(args.lines)]
+    eans = [str(synthetic.ean(rng.randrange(args.rows))) for _ in range(args.lines)]
+    lookups = args.lookups
+    with stages.time("tool_query_mapping", lookups):
+        for _ in range(lookups):
+            query_mapping.run(mdf_number=str(synthetic.mdf_number(rng.randrange(args.rows))))
+    with stages.time("tool_query_net_receipts", lookups):
+        for _ in range(lookups):
+            query_net_receipts.run(rebate_category=rng.choice(synthetic.CATEGORIES), date_month=rng.choice(synthetic.MONTHS))
+    with stages.time("tool_query_snowflake_batch", lookups):
+        for _ in range(lookups):
+            query_snowflake_batch.run(asins=asins)
+    with stages.time("tool_query_tipps_batch", lookups):
+        for _ in range(lookups):
+            query_tipps_batch.run(eans=eans)
+    with stages.time("tool_query_mapping_events", lookups):
+        for _ in range(lookups):
+            query_mapping_events.run(invoice_data={"mdf_number": str(synthetic.agreement_id(rng.randrange(args.rows)))})
+
+    # Deterministic engines
+    with stages.time("rebate_extract_fields", len(rebate_pdfs)):
+        fields = [extract_fields(texts[path]) for path in rebate_pdfs]
+    with stages.time("rebate_match_bulk", len(rebate_pdfs)):
+        match_rebates(pd.DataFrame([field.model_dump() for field in fields]))
+    with stages.time("event_match", len(event_pdfs) * args.lines):
+        event_reports = [match_event_invoice(texts[path]) for path in event_pdfs]
+
+    # LLM wall time: the crews against the stub server, model latency simulated by --llm-latency
+    llm_invoices = min(args.llm_invoices, args.invoices)
+    llm = {"latency_per_request": args.llm_latency}
+    if llm_invoices:
+        rebate_report = match_rebate_invoice(fields[0])
+        with StubLLMServer(rebate_script(fields[0], rebate_report), args.llm_latency) as stub, \
+                contextlib.redirect_stdout(io.StringIO()):
+            agent = rebates_matching.Agent(llm=stub_llm(stub))
+            with stages.time("llm_rebate_crew", llm_invoices):
+                for path in rebate_pdfs[:llm_invoices]:
+                    agent.run({"invoice": texts[path]})
+        llm["rebate_requests"] = stub.requests
+
+        with StubLLMServer(event_script(event_reports[0]), args.llm_latency) as stub, \
+                contextlib.redirect_stdout(io.StringIO()):
+            agent = events_matching.Agent(llm=stub_llm(stub))
+            with stages.time("llm_event_crew", llm_invoices):
+                for path in event_pdfs[:llm_invoices]:
+                    agent.run_event_report(texts[path])
+        llm["event_requests"] = stub.requests
+        llm["wall_seconds"] = round(stages.results["llm_rebate_crew"]["seconds"] + stages.results["llm_event_crew"]["seconds"], 4)
+        llm["overhead_seconds"] = round(llm["wall_seconds"] - args.llm_latency * (llm["rebate_requests"] + llm["event_requests"]), 4)
+
+    # End to end: both batches from cold PDF cache, as rebates_matching.py and events_matching.py run them
+    shutil.rmtree(os.path.join(".cache", "pdf_text"), ignore_errors=True)
+    errors = []
+    with StubLLMServer([{"content": "{}"}], args.llm_latency) as stub, contextlib.redirect_stdout(io.StringIO()):
+        rebate_agent = rebates_matching.Agent(llm=stub_llm(stub))
+        event_agent = events_matching.Agent(llm=stub_llm(stub))
+        with stages.time("end_to_end", len(pdfs)):
+            for batch, agent in ((rebate_pdfs, rebate_agent), (event_pdfs, event_agent)):
+                for path, _, error in run_batch(batch, extract_pdf, agent.match, args.concurrency):
+                    if error is not None:
+                        errors.append(f"{os.path.basename(path)}: {error}")
+
+    end_to_end = stages.results["end_to_end"]["seconds"]
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {key: value for key, value in vars(args).items() if key not in ("compare", "no_save")},
+        "stages": stages.results,
+        "llm": llm,
+        "invoices_per_second": round(len(pdfs) / end_to_end, 2) if end_to_end else None,
+        "errors": errors,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def save(result: dict) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = result["timestamp"].replace(":", "").replace("-", "").replace("+0000", "")
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{result['commit']['sha']}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(result, file, indent=2)
+    return path
+
+
+def load_baseline(reference: str, exclude: str = None) -> dict:
+    """
+    Reads a saved result: a path, a commit sha or "latest" (the most recent saved run other than exclude).
+    """
+    if os.path.exists(reference):
+        path = reference
+    else:
+        candidates = sorted(path for path in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if path != exclude)
+        if reference != "latest":
+            candidates = [path for path in candidates if path.endswith(f"-{reference}.json")]
+        if not candidates:
+            raise SystemExit(f"No saved benchmark matches {reference!r} in {RESULTS_DIR}")
+        path = candidates[-1]
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def format_result(result: dict, baseline: dict = None) -> str:
+    header = f"{'stage':<28}{'count':>8}{'seconds':>12}{'ms/item':>12}"
+    if baseline is not None:
+        header += f"{'baseline':>12}{'change':>10}"
+    lines = [header, "-" * len(header)]
+    for name, stage in result["stages"].items():
+        line = f"{name:<28}{stage['count']:>8}{stage['seconds']:>12.4f}{stage['ms_per_item']:>12.4f}"
+        base = (baseline or {}).get("stages", {}).get(name)
+        if base is not None:
+            change = (stage["ms_per_item"] - base["ms_per_item"]) / base["ms_per_item"] * 100 if base["ms_per_item"] else 0.0
+            line += f"{base['ms_per_item']:>12.4f}{change:>+9.1f}%"
+        lines.append(line)
+
+    lines.append("")
+    for key in ("invoices_per_second", "peak_rss_mb", "peak_rss_children_mb"):
+        line = f"{key:<28}{result[key]}"
+        if baseline is not None and baseline.get(key) is not None:
+            line += f"  (baseline {baseline[key]}, commit {baseline['commit']['sha']})"
+        lines.append(line)
+    if result["llm"].get("wall_seconds") is not None:
+        lines.append(f"{'llm_wall_seconds':<28}{result['llm']['wall_seconds']}  "
+                     f"({result['llm']['rebate_requests'] + result['llm']['event_requests']} requests, "
+                     f"{result['llm']['overhead_seconds']}s outside the model)")
+    if result["errors"]:
+        lines.append(f"\n{len(result['errors'])} invoices failed, first: {result['errors'][0]}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="Rows of each reference workbook (10 to 100000)")
+    parser.add_argument("--lines", type=int, default=50, help="Line items of each event invoice (1 to 500)")
+    parser.add_argument("--invoices", type=int, default=10, help="Rebate invoices and event invoices generated")
+    parser.add_argument("--lookups", type=int, default=200, help="Calls of each tool in the lookup stages")
+    parser.add_argument("--llm-invoices", type=int, default=2, help="Invoices sent through the crews against the stub LLM")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM waits before each answer")
+    parser.add_argument("--concurrency", type=int, default=4, help="BATCH_CONCURRENCY of the end to end stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", help='Saved result to compare with: a path, a commit sha or "latest"')
+    parser.add_argument("--no-save", action="store_true", help="Do not write the result to benchmarks/results/")
+    args = parser.parse_args(argv)
+    if not 10 <= args.rows <= 100000:
+        parser.error("--rows must be between 10 and 100000")
+    if not 1 <= args.lines <= 500:
+        parser.error("--lines must be between 1 and 500")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.path.insert(0, REPO_DIR)
+
+    # Synthetic docs/, caches and results live in a scratch folder, the repository's docs/ is never touched
+    workdir = tempfile.mkdtemp(prefix="invoice-benchmark-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        result = run(args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    path = None if args.no_save else save(result)
+    baseline = load_baseline(args.compare, exclude=path) if args.compare else None
+    print(format_result(result, baseline))
+    if path:
+        print(f"\nSaved to {os.path.relpath(path)}")
+
+
+if __name__ == "__main__":
+    main()
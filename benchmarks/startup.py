@@ -0,0 +1,84 @@
+"""
+Startup budget of the entry points.
+
+Imports each entry point in a fresh interpreter with `python -X importtime` and fails (exit code 1)
+when its cumulative import time exceeds the budget or when a heavy dependency is loaded at import:
+CrewAI, LiteLLM, pandas, pyarrow and PyPDF2 must only be imported once there is an invoice to match.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --budget-ms 300 --runs 5
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ["batch_matching", "rebates_matching", "events_matching"]
+HEAVY_MODULES = ["crewai", "litellm", "pandas", "pyarrow", "PyPDF2"]
+DEFAULT_BUDGET_MS = 500
+
+# "import time: <self us> | <cumulative us> | <indented module name>"
+IMPORT_LINE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)$')
+
+
+def import_times(module: str) -> dict:
+    """
+    Imports the module in a new interpreter and returns {top-level module: cumulative import time in ms}
+    for everything it loaded, the module itself included.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        # The line of the package itself includes its submodules and everything they imported
+        if match is not None and "." not in match.group(2):
+            name, cumulative_us = match.group(2), int(match.group(1))
+            times[name] = max(times.get(name, 0.0), cumulative_us / 1000)
+    return times
+
+
+def check(module: str, budget_ms: float, runs: int) -> list:
+    """
+    Best of `runs` cold imports of the module, checked against the budget. Returns the problems found.
+    """
+    best = min((import_times(module) for _ in range(runs)), key=lambda times: times.get(module, 0.0))
+    total_ms = best.get(module, 0.0)
+    heavy = [name for name in HEAVY_MODULES if name in best]
+
+    slowest = sorted(((ms, name) for name, ms in best.items() if name != module), reverse=True)[:5]
+    print(f"{module:<20}{total_ms:>9.1f} ms   slowest: " + ", ".join(f"{name} {ms:.1f} ms" for ms, name in slowest))
+
+    problems = []
+    if total_ms > budget_ms:
+        problems.append(f"{module} imports in {total_ms:.1f} ms, over the {budget_ms:.0f} ms budget")
+    for name in heavy:
+        problems.append(f"{module} imports {name} at startup ({best[name]:.1f} ms)")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", DEFAULT_BUDGET_MS)),
+                        help="Maximum cumulative import time of each entry point")
+    parser.add_argument("--runs", type=int, default=3, help="Imports of each entry point, the fastest one is checked")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS, help="Entry points to check")
+    args = parser.parse_args(argv)
+
+    problems = []
+    for module in args.modules:
+        problems.extend(check(module, args.budget_ms, args.runs))
+
+    if problems:
+        print("\n" + "\n".join(problems))
+        sys.exit(1)
+    print(f"\nAll entry points start within {args.budget_ms:.0f} ms without loading {', '.join(HEAVY_MODULES)}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Local stand-in for the Azure OpenAI chat completions endpoint, used by the benchmarks.
+
+It answers every POST .../chat/completions with a scripted response: the n-th assistant turn of a
+conversation gets the n-th step of the script, so a ReAct run can be replayed with tool calls and a
+final answer without network or token cost. An optional latency simulates the model time.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubLLMServer:
+    """
+    Parameters:
+    script (list): Steps, each {"content": str} or {"tool_calls": [{"name": str, "arguments": dict}]}.
+                   The last step is repeated when a conversation has more turns than the script.
+    latency (float): Seconds slept before each answer.
+    """
+
+    def __init__(self, script: list, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.script = script
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def response_for(self, body: dict) -> dict:
+        turn = sum(1 for message in body.get("messages", []) if message.get("role") == "assistant")
+        step = self.script[min(turn, len(self.script) - 1)]
+        message = {"role": "assistant", "content": step.get("content")}
+        finish_reason = "stop"
+        if step.get("tool_calls"):
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])},
+                }
+                for call in step["tool_calls"]
+            ]
+            finish_reason = "tool_calls"
+
+        prompt_chars = sum(len(str(message.get("content") or "")) for message in body.get("messages", []))
+        completion_chars = len(json.dumps(message))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": completion_chars // 4,
+                "total_tokens": (prompt_chars + completion_chars) // 4,
+            },
+        }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub.lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                payload = json.dumps(stub.response_for(body)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
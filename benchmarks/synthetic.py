@@ -0,0 +1,140 @@
+"""
+Synthetic reference workbooks and invoices with the layout of the real documents in docs/.
+
+Every generated invoice refers to rows that exist in the generated workbooks, so the whole pipeline
+(extraction, lookups, matching) runs on realistic data at any scale.
+"""
+import os
+import random
+
+import pandas as pd
+
+from benchmarks.pdf_writer import write_pdf
+from crew import reference_data
+
+MONTHS = ["January", "February", "March", "April", "May", "June",
+          "July", "August", "September", "October", "November", "December"]
+CATEGORIES = ["Beauty", "Health", "Baby", "Grocery", "Household", "Personal Care", "Sports", "Pet"]
+EVENTS = ["Prime Day", "Black Friday", "Cyber Monday", "Spring Deal Days", "Big Deal Days", "Lightning Deal"]
+
+
+def asin(number: int) -> str:
+    return f"B0{number:08d}"
+
+
+def ean(number: int) -> int:
+    return 5000000000000 + number
+
+
+def mdf_number(number: int) -> int:
+    return 100000 + number
+
+
+def agreement_id(number: int) -> int:
+    return 200000 + number
+
+
+def write_workbooks(root: str, rows: int, seed: int = 0) -> dict:
+    """
+    Writes mapping, net_receipts, snowflake, tipps and mapping_events under root/docs with `rows`
+    rows each (net_receipts always has one row per month).
+
+    Returns:
+    dict: Workbook name -> path.
+    """
+    rng = random.Random(seed)
+    paths = {
+        "mapping": os.path.join(root, reference_data.MAPPING_PATH),
+        "net_receipts": os.path.join(root, reference_data.NET_RECEIPTS_PATH),
+        "snowflake": os.path.join(root, reference_data.SNOWFLAKE_PATH),
+        "tipps": os.path.join(root, reference_data.TIPPS_PATH),
+        "mapping_events": os.path.join(root, reference_data.MAPPING_EVENTS_PATH),
+    }
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    frames = {
+        "mapping": pd.DataFrame({
+            "Rebates": [f"Rebate {number}" for number in range(rows)],
+            "Vendor Code": [f"V{number % 97:03d}" for number in range(rows)],
+            "Category": [CATEGORIES[number % len(CATEGORIES)] for number in range(rows)],
+            "MDF Number": [mdf_number(number) for number in range(rows)],
+        }),
+        "net_receipts": pd.DataFrame(
+            {"Month": MONTHS, **{category: [round(rng.uniform(1e4, 1e6), 2) for _ in MONTHS] for category in CATEGORIES}}
+        ),
+        "snowflake": pd.DataFrame({
+            "ASIN": [asin(number) for number in range(rows)],
+            "EAN_UPC": [ean(number) for number in range(rows)],
+        }),
+        "tipps": pd.DataFrame({
+            "Consumer Unit EAN/UPC Code": [ean(number) for number in range(rows)],
+            "PROMO DISCOUNT £": [round(rng.uniform(0.1, 5.0), 2) for _ in range(rows)],
+        }),
+        "mapping_events": pd.DataFrame({
+            "Agreement ID": [agreement_id(number) for number in range(rows)],
+            "Event Description": [EVENTS[number % len(EVENTS)] for number in range(rows)],
+            "Event ID": [f"EV{number:06d}" for number in range(rows)],
+        }),
+    }
+    for name, frame in frames.items():
+        frame.to_excel(paths[name], index=False)
+    return paths
+
+
+def write_rebate_invoices(root: str, count: int, rows: int, seed: int = 0) -> list:
+    """
+    Writes `count` rebate invoices in the English Amazon layout under root/docs/rebates.
+    Invoice totals are spread so the three match statuses all occur.
+    """
+    rng = random.Random(seed)
+    net_receipts = pd.read_excel(os.path.join(root, reference_data.NET_RECEIPTS_PATH)).set_index("Month")
+    paths = []
+    for number in range(count):
+        row = rng.randrange(rows)
+        month = rng.choice(MONTHS)
+        percentage = rng.choice([1, 1.5, 2, 2.5, 3, 5])
+        rebate_value = percentage / 100 * net_receipts.loc[month, CATEGORIES[row % len(CATEGORIES)]]
+        invoice_total = rebate_value + rng.choice([0, -2000, 2000]) + rng.uniform(-100, 100)
+
+        lines = [
+            "Amazon EU S.a.r.l.",
+            f"Invoice Number: INV{number:07d}",
+            f"MDF Number: {mdf_number(row)}",
+            f"Net receipts period: {month} 2024",
+            "Line Description Amount",
+            f"Marketing development funds {percentage}% of net receipts {invoice_total:,.2f}",
+            f"Invoice Total {invoice_total:,.2f}",
+        ]
+        path = os.path.join(root, os.path.dirname(reference_data.MAPPING_PATH), f"rebate_{number:05d}.pdf")
+        write_pdf(path, lines)
+        paths.append(path)
+    return paths
+
+
+def write_event_invoices(root: str, count: int, rows: int, lines: int, seed: int = 0) -> list:
+    """
+    Writes `count` event invoices with `lines` line items each under root/docs/events.
+    About one line in ten has a rebate per unit that differs from the promo discount.
+    """
+    rng = random.Random(seed)
+    promo_discounts = pd.read_excel(os.path.join(root, reference_data.TIPPS_PATH))["PROMO DISCOUNT £"].tolist()
+    paths = []
+    for number in range(count):
+        text = [
+            "Amazon EU S.a.r.l.",
+            f"Invoice Number: EVT{number:07d}",
+            f"Agreement ID: {agreement_id(rng.randrange(rows))}",
+            "ASIN Description Quantity Rebate Per Unit Line Total",
+        ]
+        for _ in range(lines):
+            row = rng.randrange(rows)
+            quantity = rng.randint(1, 500)
+            rebate_per_unit = promo_discounts[row] if rng.random() > 0.1 else round(promo_discounts[row] + 0.5, 2)
+            text.append(f"{asin(row)} Product {row} {quantity} {rebate_per_unit:.2f} {quantity * rebate_per_unit:,.2f}")
+        text.append(f"Invoice Total {rng.uniform(1e3, 1e5):,.2f}")
+
+        path = os.path.join(root, os.path.dirname(reference_data.SNOWFLAKE_PATH), f"event_{number:05d}.pdf")
+        write_pdf(path, text)
+        paths.append(path)
+    return paths
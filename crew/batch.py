@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from crew import tracing
+
+DEFAULT_CONCURRENCY = 4
+
+
+def batch_concurrency() -> int:
+    """
+    Number of invoices matched at the same time, from the BATCH_CONCURRENCY environment variable.
+    """
+    return max(1, int(os.getenv("BATCH_CONCURRENCY", DEFAULT_CONCURRENCY)))
+
+
+def run_batch(pdf_paths, extract, match, concurrency: int = None):
+    """
+    Runs extract + match for many invoices at once and yields each result as soon as it is ready.
+
+    The PDFs are extracted in a process pool (PyPDF2 is CPU bound) and each extracted text is handed
+    to a thread pool that runs the matching (crew kickoff, network bound on the LLM), so at most
+    `concurrency` invoices are waiting on the model at any time. Each invoice is one trace whose
+    "invoice" root span covers both stages (see crew/tracing.py).
+
+    Parameters:
+    pdf_paths (list): Paths of the PDF invoices.
+    extract (callable): Module-level function path -> invoice text (it must be picklable).
+    match (callable): Function invoice text -> result, shared by all worker threads.
+    concurrency (int): Maximum number of invoices matched in parallel, BATCH_CONCURRENCY by default.
+
+    Yields:
+    tuple: (pdf_path, result, error) in completion order; error is the raised exception or None.
+    """
+    concurrency = concurrency or batch_concurrency()
+    pdf_paths = list(pdf_paths)
+    if not pdf_paths:
+        return
+
+    extract_workers = min(concurrency, os.cpu_count() or 1, len(pdf_paths))
+    with ProcessPoolExecutor(max_workers=extract_workers) as extract_pool, \
+            ThreadPoolExecutor(max_workers=concurrency) as match_pool:
+        spans = {path: tracing.start_span("invoice", invoice=path) for path in pdf_paths}
+        pending = {
+            extract_pool.submit(tracing.run_traced, spans[path].context(), extract, path): ("extract", path)
+            for path in pdf_paths
+        }
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, path = pending.pop(future)
+                error = future.exception()
+
+                if stage == "extract" and error is None:
+                    text, records = future.result()
+                    tracing.export_records(records)
+                    pending[match_pool.submit(tracing.run_in_span, spans[path], match, text)] = ("match", path)
+                    continue
+
+                spans.pop(path).end(error)
+                if error is not None:
+                    yield path, None, error
+                else:
+                    yield path, future.result(), None
@@ -0,0 +1,86 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from crew.events_engine import ASIN_PATTERN, resolve_event_header
+from crew.rate_limit import estimate_tokens
+
+DEFAULT_CHUNK_TOKENS = 6000
+HEADER_FIELDS = ("agreement_id", "event_description", "event_id")
+
+
+def split_line_items(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS):
+    """
+    Splits an event invoice into chunks that each fit in max_tokens.
+
+    Every chunk holds the invoice header (the lines before the first line item: agreement ID,
+    column names of the table) followed by a contiguous run of line items. The other lines without
+    ASIN (page headers and footers repeated on every page, totals) are not sent, so the header is the
+    same size whatever the number of pages.
+
+    Raises:
+    ValueError: When the header and a single line item do not fit in max_tokens, or when a text
+                over max_tokens has no line item to split on.
+
+    Returns:
+    tuple: (header text, list of chunk texts)
+    """
+    lines = text.splitlines()
+    first_item = next((number for number, line in enumerate(lines) if ASIN_PATTERN.search(line) is not None), None)
+    if first_item is None:
+        if estimate_tokens(text) > max_tokens:
+            raise ValueError(f"Invoice of {estimate_tokens(text)} tokens has no line item to split it into chunks of {max_tokens} tokens")
+        return text, [text]
+
+    header = "\n".join(lines[:first_item])
+    items = [line for line in lines[first_item:] if ASIN_PATTERN.search(line) is not None]
+
+    # Each line costs its tokens plus the newline that joins it to the chunk
+    budget = max_tokens - estimate_tokens(header) - 1
+    item_tokens = [estimate_tokens(line) + 1 for line in items]
+    if max(item_tokens) > budget:
+        raise ValueError(
+            f"Invoice header of {estimate_tokens(header)} tokens and a line item of {max(item_tokens)} tokens "
+            f"do not fit in chunks of {max_tokens} tokens (EVENT_CHUNK_TOKENS)"
+        )
+
+    chunks = []
+    current, current_tokens = [], 0
+    for line, tokens in zip(items, item_tokens):
+        if current and current_tokens + tokens > budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += tokens
+    chunks.append(current)
+
+    return header, ["\n".join([header] + chunk) for chunk in chunks]
+
+
+def run_chunked(text: str, run_chunk, max_tokens: int = DEFAULT_CHUNK_TOKENS, concurrency: int = 4) -> dict:
+    """
+    Map-reduce matching of a long event invoice.
+
+    Map: run_chunk(chunk_text) -> event report of the chunk (dict), for all chunks concurrently; an
+    exception raised by a chunk is raised here, so the invoice fails as a whole.
+    Reduce: the invoice_data lists are concatenated in invoice order and the header fields
+    (agreement ID, event description, event ID) are resolved once, from the mapping when the
+    agreement ID is found in the header, otherwise from the first chunk that returned them.
+
+    Returns:
+    dict: The merged event report.
+    """
+    header, chunks = split_line_items(text, max_tokens)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as pool:
+        # Each chunk runs in a copy of the caller's context so its spans stay in the invoice trace
+        futures = [pool.submit(contextvars.copy_context().run, run_chunk, chunk) for chunk in chunks]
+        answers = [future.result() for future in futures]
+
+    report = {"invoice_data": []}
+    report.update(resolve_event_header(header))
+    for answer in answers:
+        report["invoice_data"].extend(answer.get("invoice_data", []))
+        for key in HEADER_FIELDS:
+            if report.get(key) is None:
+                report[key] = answer.get(key)
+    return report
@@ -0,0 +1,101 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+from crew.tracing import kickoff
+
+# CrewAI, the tools and the tasks are imported when the first crew is built, so a run that never
+# needs the crew (no pending invoice, or invoices fully matched by the engines) does not load them
+
+
+def rebate_tools() -> list:
+    from crew.tools import query_mapping, search_mapping_semantic, query_net_receipts, calculate_rebate_value
+    return [query_mapping, search_mapping_semantic, query_net_receipts, calculate_rebate_value]
+
+
+def event_tools() -> list:
+    from crew.tools import query_snowflake_batch, query_tipps_batch, query_mapping_events, search_events_semantic
+    return [query_snowflake_batch, query_tipps_batch, query_mapping_events, search_events_semantic]
+
+
+def rebate_crew(llm):
+    from crewai import Crew, Process
+    from crew.agents import agent_business_analyst
+    from crew.tasks import amazon_invoice_matching_rebate
+
+    senior_business_analyst = agent_business_analyst(llm, rebate_tools())
+    return Crew(
+        agents=[senior_business_analyst],
+        tasks=[amazon_invoice_matching_rebate(senior_business_analyst)],
+        process=Process.sequential,
+        verbose=True,
+        output_log_file="crew.log"
+    )
+
+
+def event_crew(llm):
+    from crewai import Crew, Process
+    from crew.agents import agent_business_analyst
+    from crew.tasks import amazon_invoice_matching_event
+
+    senior_business_analyst = agent_business_analyst(llm, event_tools())
+    return Crew(
+        agents=[senior_business_analyst],
+        tasks=[amazon_invoice_matching_event(senior_business_analyst)],
+        process=Process.sequential,
+        verbose=True,
+        output_log_file="crew.log"
+    )
+
+
+class CrewPool:
+    """
+    Crews built once and reused for every invoice: the agent, its tools and the task template are
+    constructed at most `size` times per process and every kickoff only binds the new {invoice} input
+    (CrewAI keeps the original task description and interpolates it again on each kickoff).
+    All the crews share the same LLM instance, and therefore its HTTP client and open connections.
+
+    A crew holds the state of the run in progress, so each one serves a single invoice at a time;
+    size is the number of invoices that can be matched concurrently.
+
+    Parameters:
+    build (callable): llm -> Crew, e.g. rebate_crew or event_crew.
+    llm (LLM): The shared CrewAI LLM.
+    size (int): Maximum number of crews, built lazily when all the others are busy.
+    """
+
+    def __init__(self, build, llm, size: int):
+        self.build = build
+        self.llm = llm
+        self.size = max(1, size)
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def crew(self):
+        """Checks out an idle crew (building one if the pool is not full yet) and returns it afterwards."""
+        try:
+            crew = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                build = self.created < self.size
+                if build:
+                    self.created += 1
+            if not build:
+                crew = self.idle.get()
+            else:
+                try:
+                    crew = self.build(self.llm)
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+        try:
+            yield crew
+        finally:
+            self.idle.put(crew)
+
+    def kickoff(self, inputs: dict):
+        with self.crew() as crew:
+            return kickoff(crew, inputs)
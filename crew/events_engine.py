@@ -0,0 +1,228 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from crew import reference_data, tracing
+from crew.models import parse_json_output
+
+DEFAULT_TOLERANCE = 0.01
+
+# Amazon ASINs are 10 characters starting with "B0"
+ASIN_PATTERN = re.compile(r'\b(B0[0-9A-Z]{8})\b')
+AMOUNT_PATTERN = re.compile(r'-?(?:\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,]\d{1,4})?')
+# The number printed after an "Agreement ID" or "MDF" label, like extractors.MDF
+AGREEMENT_ID_PATTERN = re.compile(r'(?:Agreement\s*ID|MDF)\D{0,20}?(\d{4,})', re.IGNORECASE)
+
+LINE_COLUMNS = ["asin", "rebate_per_unit", "line_total"]
+
+
+def parse_amount(token: str) -> float:
+    """
+    Parses an invoice amount written either as 1,234.56 (UK) or 1.234,56 (EU).
+
+    With both separators the last one is the decimal point. With only one kind, "," and "." are read
+    the same way: repeated, or once followed by exactly three digits after a non-zero integer part,
+    it separates thousands (1,234 and 1.234 are both 1234, 0.125 stays 0.125); otherwise it is the
+    decimal point (2,5 and 2.5 are both 2.5).
+    """
+    token = token.strip()
+    if "," not in token and "." not in token:
+        return float(token)
+
+    if "," in token and "." in token:
+        decimal = "," if token.rfind(",") > token.rfind(".") else "."
+    else:
+        separator = "," if "," in token else "."
+        head, _, tail = token.rpartition(separator)
+        thousands = token.count(separator) > 1 or (len(tail) == 3 and head.lstrip("-") not in ("", "0"))
+        decimal = None if thousands else separator
+
+    if decimal is None:
+        return float(token.replace(",", "").replace(".", ""))
+    integer, _, fraction = token.rpartition(decimal)
+    return float(integer.replace(",", "").replace(".", "") + "." + fraction)
+
+
+def parse_invoice_lines(text: str):
+    """
+    Extracts the line-item table (ASIN, Rebate Per Unit, Line Total) from the PDF text.
+
+    A line item is a text line that contains an ASIN followed by at least three amounts: the last
+    three are the quantity, the rebate per unit and the line total, and they must agree
+    (quantity x rebate per unit = line total, give or take the rounding of the printed amounts).
+    Lines that do not, e.g. a description ending with numbers, are left to the LLM as unparsed.
+
+    Returns:
+    tuple: (DataFrame with the columns asin, rebate_per_unit, line_total, list of the lines that contain an ASIN but could not be parsed)
+    """
+    rows = []
+    unparsed = []
+    for line in text.splitlines():
+        match = ASIN_PATTERN.search(line)
+        if match is None:
+            continue
+
+        amounts = AMOUNT_PATTERN.findall(line[match.end():])
+        if len(amounts) < 3:
+            unparsed.append(line)
+            continue
+
+        try:
+            quantity, rebate_per_unit, line_total = (parse_amount(amount) for amount in amounts[-3:])
+        except ValueError:
+            unparsed.append(line)
+            continue
+
+        # Half a penny per unit for the rounded rebate per unit, one penny for the rounded total
+        if abs(quantity * rebate_per_unit - line_total) > 0.005 * abs(quantity) + 0.01:
+            unparsed.append(line)
+            continue
+
+        rows.append((match.group(1), rebate_per_unit, line_total))
+
+    return pd.DataFrame(rows, columns=LINE_COLUMNS), unparsed
+
+
+def match_event_lines(lines: pd.DataFrame, tolerance: float = DEFAULT_TOLERANCE) -> pd.DataFrame:
+    """
+    Joins the invoice lines against snowflake (ASIN -> EAN) and tipps (EAN -> promo discount)
+    and compares the rebate per unit with the promo discount for all lines at once.
+
+    Parameters:
+    lines (DataFrame): Output of parse_invoice_lines.
+    tolerance (float): Maximum absolute difference between rebate per unit and promo discount to count as "matched".
+
+    Returns:
+    DataFrame: The lines with the added columns ean, promo_discount and result.
+    """
+    snowflake = reference_data.snowflake().first_rows()[["key", "EAN_UPC"]]
+    tipps = reference_data.tipps().first_rows()[["key", "PROMO DISCOUNT £"]]
+
+    result = lines.assign(asin_key=lines["asin"].str.lower())
+    result = result.merge(snowflake.rename(columns={"key": "asin_key", "EAN_UPC": "ean"}), on="asin_key", how="left")
+    result = result.merge(tipps.rename(columns={"key": "ean", "PROMO DISCOUNT £": "promo_discount"}), on="ean", how="left")
+
+    rebate_per_unit = result["rebate_per_unit"].to_numpy(dtype=float)
+    promo_discount = pd.to_numeric(result["promo_discount"], errors="coerce").to_numpy(dtype=float)
+    matched = np.abs(rebate_per_unit - promo_discount) <= tolerance  # NaN promo discounts compare False
+
+    result["promo_discount"] = promo_discount
+    result["result"] = np.where(matched, "matched", "not matched")
+    return result.drop(columns=["asin_key"])[LINE_COLUMNS + ["ean", "promo_discount", "result"]]
+
+
+def resolve_event_header(text: str) -> dict:
+    """
+    Finds the Agreement ID (MDF number) of the invoice by looking up the numbers printed after an
+    "Agreement ID" or "MDF" label in the events mapping, and returns it with its Event Description
+    and Event ID.
+    """
+    table = reference_data.mapping_events()
+    for token in AGREEMENT_ID_PATTERN.findall(text):
+        row = table.first(token)
+        if row is not None:
+            return {
+                "agreement_id": token,
+                "event_description": reference_data.json_value(row["Event Description"]),
+                "event_id": reference_data.json_value(row["Event ID"]),
+            }
+    return {"agreement_id": None, "event_description": None, "event_id": None}
+
+
+def to_invoice_data(matched: pd.DataFrame) -> list:
+    """
+    Converts matched lines into the invoice_data list of the event report.
+    """
+    return [
+        {key: reference_data.json_value(value) for key, value in record.items()}
+        for record in matched.to_dict(orient="records")
+    ]
+
+
+def iter_matched_lines(pages, tolerance: float = DEFAULT_TOLERANCE, unparsed: list = None):
+    """
+    Parses and matches the invoice page by page, yielding the matched lines of each page as soon
+    as it is available, so matching starts while later pages are still being extracted.
+
+    Parameters:
+    pages (iterable): Page texts, e.g. crew.pdf.iter_pages_parallel(file_path).
+    tolerance (float): See match_event_lines.
+    unparsed (list): If given, the lines that could not be parsed are appended to it.
+    """
+    for page in pages:
+        lines, page_unparsed = parse_invoice_lines(page)
+        if unparsed is not None:
+            unparsed.extend(page_unparsed)
+        if not lines.empty:
+            yield match_event_lines(lines, tolerance)
+
+
+def match_event_pages(pages, tolerance: float = DEFAULT_TOLERANCE):
+    """
+    Deterministic version of steps 1-5 of the amazon_invoice_matching_event task over a stream of pages.
+    Only the matched rows, the first page's header and the lines that could not be parsed are kept,
+    never the whole invoice text, so memory does not grow with the page headers and footers.
+
+    Returns:
+    tuple: (report, fallback_text). The report holds invoice_data, agreement_id, event_description,
+           event_id and unparsed_lines (the line items the LLM still has to read); fallback_text is
+           the first page's text without line items followed by the unparsed lines, to send to the LLM.
+    """
+    invoice_data = []
+    unparsed = []
+    header = {"agreement_id": None, "event_description": None, "event_id": None}
+    context_lines = []
+
+    def remember(pages):
+        # Keeps the header text of the first page and resolves the agreement ID on the fly
+        for number, page in enumerate(pages):
+            if number == 0:
+                context_lines.extend(line for line in page.splitlines() if ASIN_PATTERN.search(line) is None)
+            if header["agreement_id"] is None:
+                header.update(resolve_event_header(page))
+            yield page
+
+    with tracing.span("engine.events") as span:
+        for matched in iter_matched_lines(remember(pages), tolerance, unparsed):
+            invoice_data.extend(to_invoice_data(matched))
+        span.set(lines=len(invoice_data), unparsed_lines=len(unparsed))
+
+    report = {"invoice_data": invoice_data}
+    report.update(header)
+    report["unparsed_lines"] = unparsed
+    return report, "\n".join(context_lines + unparsed)
+
+
+def match_event_invoice(text: str, tolerance: float = DEFAULT_TOLERANCE) -> dict:
+    """
+    Deterministic version of steps 1-5 of the amazon_invoice_matching_event task.
+
+    Returns:
+    dict: The event report (invoice_data, agreement_id, event_description, event_id) plus
+          unparsed_lines, the invoice lines that must still be read by the LLM.
+    """
+    report, _ = match_event_pages([text], tolerance)
+    return report
+
+
+def merge_fallback(report: dict, fallback) -> dict:
+    """
+    Adds the invoice_data rows produced by the LLM for the unparsed lines to the deterministic report.
+
+    Parameters:
+    report (dict): Report of match_event_pages.
+    fallback (dict or str): The LLM event report; a raw answer that is not valid json is kept as-is under fallback_raw.
+    """
+    if isinstance(fallback, str):
+        raw, fallback = fallback, parse_json_output(fallback)
+        if not isinstance(fallback, dict):
+            report["fallback_raw"] = raw
+            return report
+
+    report["invoice_data"].extend(fallback.get("invoice_data", []))
+    for key in ("agreement_id", "event_description", "event_id"):
+        if report.get(key) is None:
+            report[key] = fallback.get(key)
+    report["unparsed_lines"] = []
+    return report
@@ -0,0 +1,150 @@
+import re
+from dataclasses import dataclass, field
+
+from crew.events_engine import parse_amount
+from crew.models import InvoiceFields
+
+AMOUNT = r'(-?(?:\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,]\d{1,2})?)'
+MDF = r'MDF\D{0,20}?(\d{4,})'
+PERCENTAGE = r'(\d+(?:[.,]\d+)?)\s?%'
+
+MONTHS = {
+    "en": ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"],
+    "it": ["gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno", "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"],
+    "de": ["januar", "februar", "märz", "april", "mai", "juni", "juli", "august", "september", "oktober", "november", "dezember"],
+    "fr": ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre", "octobre", "novembre", "décembre"],
+    "es": ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"],
+}
+
+
+def _month_parser(language: str):
+    names = {name: MONTHS["en"][number].capitalize() for number, name in enumerate(MONTHS[language])}
+    return lambda value: names[value.lower()]
+
+
+def _month_pattern(language: str, label: str = "") -> str:
+    return label + r'\b(' + "|".join(MONTHS[language]) + r')\b'
+
+
+@dataclass
+class FieldRule:
+    """
+    One way of finding a field: a regex whose first group is the value, the confidence given to a
+    match and the function converting the matched text.
+    """
+    pattern: re.Pattern
+    confidence: float
+    parse: callable = str
+
+
+@dataclass
+class ExtractionResult:
+    template: str
+    fields: InvoiceFields
+    confidence: dict = field(default_factory=dict)
+
+    def score(self, required=("percentage", "invoice_total", "invoice_month", "mdf_number")) -> float:
+        """Overall confidence: the weakest of the required fields."""
+        return min(self.confidence.get(name, 0.0) for name in required)
+
+
+@dataclass
+class InvoiceTemplate:
+    """
+    Compiled layout of a vendor invoice in one language.
+
+    Parameters:
+    name (str): Template name, e.g. "amazon_en".
+    detect (Pattern): Tells whether a document is in this layout.
+    rules (dict): Field name -> FieldRules tried in order, the first one that matches wins.
+    """
+    name: str
+    detect: re.Pattern
+    rules: dict
+
+    def matches(self, text: str) -> bool:
+        return self.detect.search(text) is not None
+
+    def extract(self, text: str) -> ExtractionResult:
+        values = {}
+        confidence = {}
+        for name, rules in self.rules.items():
+            for rule in rules:
+                found = [match.group(1) for match in rule.pattern.finditer(text)]
+                if not found:
+                    continue
+                try:
+                    parsed = [rule.parse(value) for value in found]
+                except (KeyError, ValueError):
+                    continue
+                values[name] = parsed[0]
+                # Several different candidates for the same field lower the confidence
+                confidence[name] = rule.confidence if len(set(parsed)) == 1 else rule.confidence / 2
+                break
+            else:
+                confidence[name] = 0.0
+        return ExtractionResult(self.name, InvoiceFields(**values), confidence)
+
+
+_templates = []
+
+
+def register_template(template: InvoiceTemplate):
+    """
+    Adds a template to the registry; later registrations are tried first.
+    """
+    _templates.insert(0, template)
+    return template
+
+
+def templates() -> list:
+    return list(_templates)
+
+
+def extract(text: str):
+    """
+    Runs every template whose layout matches the document and returns the most confident result,
+    or None if no template applies.
+    """
+    results = [template.extract(text) for template in _templates if template.matches(text)]
+    if not results:
+        return None
+    return max(results, key=ExtractionResult.score)
+
+
+def _compile(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def amazon_template(language: str, invoice_number_label: str, invoice_total_label: str, period_label: str) -> InvoiceTemplate:
+    """
+    Builds the template of the Amazon rebate invoice layout for one language: labelled invoice number,
+    MDF number, a percentage in the line description, the invoice total and the net receipts period.
+    """
+    month = _month_parser(language)
+    return InvoiceTemplate(
+        name=f"amazon_{language}",
+        detect=_compile(invoice_number_label),
+        rules={
+            "invoice_number": [FieldRule(_compile(invoice_number_label + r'\s*[:#.]?\s*([A-Z0-9\-/]*\d[A-Z0-9\-/]*)'), 1.0)],
+            "mdf_number": [FieldRule(_compile(MDF), 1.0)],
+            "percentage": [FieldRule(_compile(PERCENTAGE), 0.9, parse_amount)],
+            "invoice_total": [
+                FieldRule(_compile(invoice_total_label + r'\D{0,30}?' + AMOUNT), 1.0, parse_amount),
+                FieldRule(_compile(r'Invoice\s+Total\D{0,30}?' + AMOUNT), 0.9, parse_amount),
+            ],
+            "invoice_month": [
+                FieldRule(_compile(_month_pattern(language, period_label + r'[^\n]{0,40}?')), 1.0, month),
+                # Local invoices often describe the net receipts period in English
+                FieldRule(_compile(_month_pattern("en", r'period[^\n]{0,40}?')), 0.9, _month_parser("en")),
+                FieldRule(_compile(_month_pattern(language)), 0.5, month),
+            ],
+        },
+    )
+
+
+register_template(amazon_template("es", r'N[úu]mero\s+de\s+factura', r'Total\s+(?:de\s+la\s+)?factura', r'periodo'))
+register_template(amazon_template("fr", r'Num[ée]ro\s+de\s+facture', r'Total\s+(?:de\s+la\s+)?facture', r'p[ée]riode'))
+register_template(amazon_template("de", r'Rechnungsnummer', r'(?:Rechnungsbetrag|Rechnungssumme|Gesamtbetrag)', r'Zeitraum'))
+register_template(amazon_template("it", r'Numero\s+Fattura', r'Totale\s+Fattura', r'periodo'))
+register_template(amazon_template("en", r'Invoice\s+(?:Number|No\.?)', r'Invoice\s+Total', r'period'))
@@ -0,0 +1,142 @@
+import bisect
+import re
+
+DEFAULT_LIMIT = 5
+DEFAULT_MAX_DISTANCE = 2
+MIN_PREFIX_LENGTH = 3
+
+# Characters OCR commonly reads in place of digits
+OCR_DIGITS = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "|": "1", "Z": "2", "S": "5", "B": "8", "G": "6"})
+SEPARATORS = re.compile(r'[\s\-_/.]+')
+
+
+def canonical(key) -> str:
+    """
+    Comparable form of an identifier: upper case, without spaces or separators ("mdf 12-345" -> "MDF12345").
+    """
+    return SEPARATORS.sub("", str(key)).upper()
+
+
+def ocr_form(key: str) -> str:
+    """
+    canonical() with the letters OCR confuses with digits mapped to those digits, so "1O234" and "10234" compare equal.
+    """
+    return canonical(key).translate(OCR_DIGITS)
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Edit distance counting an adjacent transposition as one edit (typing and OCR swaps), stopped
+    early: returns max_distance + 1 as soon as it is exceeded.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(text: str) -> set:
+    """The text and every string obtained by deleting one of its characters."""
+    return {text} | {text[:i] + text[i + 1:] for i in range(len(text))}
+
+
+class IdIndex:
+    """
+    Lookup structure over the identifier column of a workbook (MDF Number, Agreement ID), built once
+    per workbook version:
+        - exact: dict of canonical keys
+        - prefix: sorted canonical keys searched with bisect (partial IDs)
+        - fuzzy: single-deletion neighbourhoods of the OCR form of the keys (two IDs one substitution,
+          insertion, deletion or swap apart share a neighbour), candidates ranked by edit distance.
+          Built on the first fuzzy lookup.
+
+    Parameters:
+    keys (iterable): The normalized keys of the table (ReferenceTable.index keys).
+    """
+
+    def __init__(self, keys):
+        self.keys = {}
+        for key in keys:
+            self.keys.setdefault(canonical(key), key)
+        self.sorted_keys = sorted(self.keys)
+
+        self.ocr_keys = None
+        self.neighbours = None
+
+    def _build_fuzzy(self):
+        ocr_keys = {}
+        for canonical_key in self.sorted_keys:
+            ocr_keys.setdefault(ocr_form(canonical_key), []).append(canonical_key)
+        neighbours = {}
+        for ocr_key in ocr_keys:
+            for variant in _deletes(ocr_key):
+                neighbours.setdefault(variant, []).append(ocr_key)
+        self.ocr_keys, self.neighbours = ocr_keys, neighbours
+
+    def exact(self, query):
+        """The original key equal to the query once canonicalized, or None."""
+        return self.keys.get(canonical(query))
+
+    def prefix(self, query, limit: int = DEFAULT_LIMIT) -> list:
+        """Keys starting with the query, in sorted order."""
+        query = canonical(query)
+        if len(query) < MIN_PREFIX_LENGTH:
+            return []
+        start = bisect.bisect_left(self.sorted_keys, query)
+        # Keys with the prefix are contiguous in sorted order, the upper bound is the next string after them
+        stop = bisect.bisect_left(self.sorted_keys, query + "\U0010ffff", start, min(start + limit, len(self.sorted_keys)))
+        return [self.keys[canonical_key] for canonical_key in self.sorted_keys[start:stop]]
+
+    def fuzzy(self, query, limit: int = DEFAULT_LIMIT, max_distance: int = DEFAULT_MAX_DISTANCE) -> list:
+        """
+        [(key, distance)] of the keys within max_distance edits of the query (after OCR normalization),
+        closest first.
+        """
+        query = ocr_form(query)
+        if not query:
+            return []
+        if self.neighbours is None:
+            self._build_fuzzy()
+        candidates = {ocr_key for variant in _deletes(query) for ocr_key in self.neighbours.get(variant, ())}
+
+        matches = []
+        for ocr_key in candidates:
+            distance = edit_distance(query, ocr_key, max_distance)
+            if distance <= max_distance:
+                matches.extend((self.keys[canonical_key], distance) for canonical_key in self.ocr_keys[ocr_key])
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches[:limit]
+
+    def search(self, query, limit: int = DEFAULT_LIMIT, max_distance: int = DEFAULT_MAX_DISTANCE) -> list:
+        """
+        Ranked lookup: the exact match alone if there is one, otherwise the keys starting with the query,
+        then the OCR/edit-distance neighbours. Returns [{"key", "match": "exact" | "prefix" | "fuzzy", "score"}], score in ]0, 1].
+        """
+        results = []
+        seen = set()
+
+        def add(key, match, score):
+            if key not in seen and len(results) < limit:
+                seen.add(key)
+                results.append({"key": key, "match": match, "score": round(score, 3)})
+
+        exact = self.exact(query)
+        if exact is not None:
+            return [{"key": exact, "match": "exact", "score": 1.0}]
+        length = max(len(canonical(query)), 1)
+        for key in self.prefix(query, limit):
+            add(key, "prefix", 0.9 * length / max(len(canonical(key)), length))
+        for key, distance in self.fuzzy(query, limit, max_distance):
+            add(key, "fuzzy", 0.8 * (1 - distance / (length + 1)))
+        return results
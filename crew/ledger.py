@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from crew.utils import file_sha256
+
+RESULTS_DIR = "results"
+
+
+class Ledger:
+    """
+    Append-only JSONL log of processed invoices, used to make batch runs incremental and resumable.
+
+    Each line records an invoice's path, content hash, the reference-data version it was matched
+    against, its status ("done" or "error") and its output. The structured output of each invoice is
+    also written to results/<kind>/<invoice name>.<path hash>.json, the hash of the invoice path keeping
+    apart same-named invoices of different folders.
+
+    Parameters:
+    kind (str): "rebates" or "events", the sub folder of the per-invoice json files.
+    results_dir (str): Folder holding ledger.jsonl and the json files.
+    """
+
+    def __init__(self, kind: str, results_dir: str = RESULTS_DIR):
+        self.kind = kind
+        self.results_dir = results_dir
+        self.path = os.path.join(results_dir, "ledger.jsonl")
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(results_dir, kind), exist_ok=True)
+
+        # In-memory index of the last record per invoice and how far the file has been read, so a
+        # resident process only reads the lines appended since (by itself or by another process)
+        self._latest = {}
+        self._offset = 0
+
+    def latest(self) -> dict:
+        """
+        Returns the last record of every invoice of this kind, keyed by file path.
+        A truncated last line (crash or write in progress) is ignored until it is complete.
+        """
+        with self.lock:
+            self._refresh()
+            return dict(self._latest)
+
+    def last(self, path: str):
+        """The last record of one invoice, or None."""
+        with self.lock:
+            self._refresh()
+            return self._latest.get(path)
+
+    def _refresh(self):
+        try:
+            with open(self.path, "rb") as ledger:
+                if os.fstat(ledger.fileno()).st_size < self._offset:
+                    # The ledger was replaced or truncated, read it again from the start
+                    self._latest, self._offset = {}, 0
+                ledger.seek(self._offset)
+                for line in ledger:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("kind") == self.kind:
+                        self._latest[record["file"]] = record
+        except FileNotFoundError:
+            self._latest, self._offset = {}, 0
+
+    def pending(self, pdf_paths, reference_version: str) -> dict:
+        """
+        Returns {path: sha256} of the invoices that still have to be processed: new files, changed
+        files, files that failed last time and files matched against another reference-data version.
+        """
+        latest = self.latest()
+        pending = {}
+        for path in pdf_paths:
+            sha256 = file_sha256(path)
+            record = latest.get(path)
+            if (record is None or record["status"] != "done" or record["sha256"] != sha256
+                    or record["reference_version"] != reference_version):
+                pending[path] = sha256
+        return pending
+
+    def result_path(self, path: str) -> str:
+        """
+        Json file of the invoice's output, e.g. results/events/invoice_01.3f2a9c1e.json for docs/vendor_a/invoice_01.pdf.
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        path_hash = hashlib.sha256(os.path.normpath(path).encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.results_dir, self.kind, f"{name}.{path_hash}.json")
+
+    def record(self, path: str, sha256: str, reference_version: str, output=None, error: BaseException = None):
+        """
+        Appends the outcome of one invoice and, when it succeeded, writes its json file.
+        The ledger is flushed to disk immediately so a crash never loses finished invoices.
+        """
+        if isinstance(output, str):
+            try:
+                output = json.loads(output)
+            except ValueError:
+                pass
+
+        record = {
+            "file": path,
+            "kind": self.kind,
+            "sha256": sha256,
+            "reference_version": reference_version,
+            "status": "error" if error is not None else "done",
+            "output": output,
+            "error": repr(error) if error is not None else None,
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+        with self.lock:
+            if error is None:
+                with open(self.result_path(path), "w", encoding="utf-8") as result_file:
+                    json.dump(output, result_file, indent=2, default=str)
+
+            with open(self.path, "a", encoding="utf-8") as ledger:
+                ledger.write(json.dumps(record, default=str) + "\n")
+                ledger.flush()
+                os.fsync(ledger.fileno())
+        return record
@@ -0,0 +1,35 @@
+import os
+
+from crew.llm_cache import cached
+from crew.rate_limit import rate_limited
+from crew.tracing import traced_llm
+
+
+def azure_llm():
+    """
+    CrewAI LLM of the Azure OpenAI deployment configured in the .env file (AZURE_DEPLOYMENT,
+    AZURE_ENDPOINT, OPENAI_API_VERSION, API_KEY). CrewAI is imported here, on first use.
+    """
+    from crewai import LLM
+
+    deployment = os.getenv("AZURE_DEPLOYMENT")
+    kenvue_endpoint = os.getenv("AZURE_ENDPOINT")
+    api_version = os.getenv("OPENAI_API_VERSION")
+    api_key = os.getenv("API_KEY")
+
+    return LLM(
+        model=f"azure/{deployment}",
+        base_url=f"{kenvue_endpoint}/openai/deployments/{deployment}/chat/completions?api-version={api_version}",
+        api_key=api_key
+    )
+
+
+def agent_llm(llm=None):
+    """
+    The LLM shared by an agent's crews and repair calls: answers are cached on disk (crew/llm_cache.py),
+    misses share the RPM/TPM budget (crew/rate_limit.py) and every call is traced (crew/tracing.py).
+
+    Parameters:
+    llm (LLM): CrewAI LLM to use instead of the Azure deployment from the .env file (e.g. the benchmark stub).
+    """
+    return traced_llm(cached(rate_limited(llm if llm is not None else azure_llm())))
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from crew import reference_data, tracing
+
+CACHE_PATH = os.path.join(".cache", "llm_cache.sqlite")
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 20000
+
+
+class LLMCache:
+    """
+    Persistent cache of LLM answers in a SQLite file.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted above
+    `max_entries`. Hits and misses are counted for the lifetime of the process.
+
+    Parameters:
+    path (str): SQLite file.
+    ttl (int): Time to live of an entry in seconds.
+    max_entries (int): Maximum number of entries kept.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: int = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(deployment, temperature, prompt, **extra) -> str:
+        """
+        Hash of everything that determines the answer: deployment, temperature, the rendered prompt
+        (chat messages, including earlier tool results) and the reference-data version.
+        """
+        payload = {
+            "deployment": deployment,
+            "temperature": temperature,
+            "prompt": prompt,
+            "reference_version": reference_data.reference_version(),
+            **extra,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self.connection.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self.connection.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.connection.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """
+    Process-wide cache configured from LLM_CACHE_PATH, LLM_CACHE_TTL and LLM_CACHE_MAX_ENTRIES.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                path=os.getenv("LLM_CACHE_PATH", CACHE_PATH),
+                ttl=int(os.getenv("LLM_CACHE_TTL", DEFAULT_TTL)),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            )
+        return _cache
+
+
+TOOL_CALLS_PREFIX = "\x00tool_calls:"
+
+
+def normalize_tool_call_ids(messages):
+    """
+    Replaces the tool call ids of a conversation (random for every run) with their order of appearance,
+    so the same conversation always gives the same cache key.
+    """
+    if not isinstance(messages, list):
+        return messages
+    ids = {}
+
+    def stable(call_id):
+        return ids.setdefault(call_id, f"call_{len(ids)}")
+
+    normalized = []
+    for message in messages:
+        if isinstance(message, dict):
+            message = dict(message)
+            if message.get("tool_calls"):
+                message["tool_calls"] = [
+                    {**tool_call, "id": stable(tool_call.get("id"))} if isinstance(tool_call, dict) else tool_call
+                    for tool_call in message["tool_calls"]
+                ]
+            if "tool_call_id" in message:
+                message["tool_call_id"] = stable(message["tool_call_id"])
+        normalized.append(message)
+    return normalized
+
+
+def _dump_tool_calls(result):
+    """
+    Serializes an OpenAI-style list of tool calls (objects or dicts with .function.name / .arguments),
+    or returns None for any other answer.
+    """
+    if not isinstance(result, list) or not result:
+        return None
+    tool_calls = []
+    for tool_call in result:
+        function = tool_call.get("function") if isinstance(tool_call, dict) else getattr(tool_call, "function", None)
+        if function is None:
+            return None
+        name = function.get("name") if isinstance(function, dict) else getattr(function, "name", None)
+        arguments = function.get("arguments") if isinstance(function, dict) else getattr(function, "arguments", None)
+        tool_calls.append({"name": name, "arguments": arguments})
+    return TOOL_CALLS_PREFIX + json.dumps(tool_calls, sort_keys=True, default=str)
+
+
+def _load_tool_calls(value: str) -> list:
+    # CrewAI's executor accepts tool calls as OpenAI-style dicts; each replay gets fresh ids
+    return [
+        {"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function", "function": tool_call}
+        for tool_call in json.loads(value[len(TOOL_CALLS_PREFIX):])
+    ]
+
+
+def cached(llm, cache: LLMCache = None):
+    """
+    Answers repeated calls of a CrewAI LLM from the persistent cache and returns the same instance.
+    Text answers and tool-call answers are cached, keyed on the conversation with its tool call ids
+    normalized, so every turn of an unchanged invoice is answered from the cache on a re-run.
+    Structured (response_model) responses always go to the model.
+    """
+    cache = cache or get_llm_cache()
+    call = llm.call
+
+    def cached_call(messages, tools=None, *args, **kwargs):
+        key = cache.make_key(
+            llm.model,
+            getattr(llm, "temperature", None),
+            normalize_tool_call_ids(messages),
+            tools=tools
+        )
+        value = cache.get(key)
+        tracing.set_attributes(cache="miss" if value is None else "hit")
+        if value is not None:
+            return _load_tool_calls(value) if value.startswith(TOOL_CALLS_PREFIX) else value
+
+        result = call(messages, tools, *args, **kwargs)
+        if isinstance(result, str):
+            cache.set(key, result)
+        else:
+            dumped = _dump_tool_calls(result)
+            if dumped is not None:
+                cache.set(key, dumped)
+        return result
+
+    object.__setattr__(llm, "call", cached_call)
+    return llm
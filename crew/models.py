@@ -0,0 +1,146 @@
+import json
+from typing import List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+MATCH_STATUSES = {"fully": "Fully Matched", "partially": "Partially Matched", "not": "Not Matched"}
+
+
+class InvoiceFields(BaseModel):
+    """Everything the rebate matching needs from the invoice document."""
+    percentage: Optional[float] = Field(None, description='Percentage found in a row of the "Line Description" column, as written (e.g. 2.5 for 2.5%)')
+    invoice_total: Optional[float] = Field(None, description="Invoice total")
+    invoice_month: Optional[str] = Field(None, description="Full month name of the net receipts period")
+    mdf_number: Optional[str] = Field(None, description="The MDF number")
+    invoice_number: Optional[str] = Field(None, description='Value to the right of "Invoice Number", "Numero Fattura" or similar depending on the language')
+
+    @field_validator("invoice_number", "mdf_number", mode="before")
+    @classmethod
+    def to_string(cls, value):
+        return None if value is None else str(value)
+
+
+class RebateReport(BaseModel):
+    """Output of the amazon_invoice_matching_rebate task."""
+    invoice_number: Optional[str] = Field(None, description="Extracted invoice number from Invoice Document")
+    mdf_number: Optional[str] = Field(None, description="MDF reference from Invoice Document")
+    invoice_total: Optional[float] = Field(None, description="Total amount from Invoice Document")
+    invoice_month: Optional[str] = Field(None, description="Full name of the month of the net receipts period")
+    rebate_name: Optional[str] = Field(None, description="Mapped rebate name from Mapping")
+    category: Optional[str] = Field(None, description="Category from Mapping")
+    rebate_value: Optional[float] = Field(None, description="Calculated rebate amount (percentage / 100 * net receipt) from tool calculate_rebate_value")
+    match_status: Literal["Fully Matched", "Partially Matched", "Not Matched"] = Field(description="Fully/Partially/Not Matched")
+
+    @field_validator("match_status", mode="before")
+    @classmethod
+    def normalize_match_status(cls, value):
+        # Accepts "fully", "Partially matched", "NOT MATCHED"...
+        first_word = str(value).strip().split(" ")[0].lower()
+        return MATCH_STATUSES.get(first_word, value)
+
+    @field_validator("invoice_number", "mdf_number", mode="before")
+    @classmethod
+    def to_string(cls, value):
+        return None if value is None else str(value)
+
+
+class EventLine(BaseModel):
+    """One row of invoice_data in the event report."""
+    asin: str = Field(description="ASIN number")
+    rebate_per_unit: Optional[float] = Field(None, description="Rebate per unit amount")
+    line_total: Optional[float] = Field(None, description="Total amount for the line")
+    ean: Optional[str] = Field(None, description="Corresponding EAN code")
+    promo_discount: Optional[Union[float, str]] = Field(None, description="Promo discount amount")
+    result: Literal["matched", "not matched"] = Field(description='"matched" or "not matched"')
+
+    @field_validator("result", mode="before")
+    @classmethod
+    def normalize_result(cls, value):
+        return str(value).strip().lower()
+
+    @field_validator("ean", mode="before")
+    @classmethod
+    def to_string(cls, value):
+        return None if value is None else str(value)
+
+
+class EventReport(BaseModel):
+    """Output of the amazon_invoice_matching_event task."""
+    invoice_data: List[EventLine] = Field(default_factory=list)
+    agreement_id: Optional[str] = Field(None, description="Extracted MDF number as Agreement ID")
+    event_description: Optional[str] = Field(None, description="Corresponding Event Description from mapping")
+    event_id: Optional[str] = Field(None, description="Corresponding Event ID from mapping")
+    unparsed_lines: List[str] = Field(default_factory=list, description="Invoice lines that could not be matched")
+
+    @field_validator("agreement_id", "event_id", mode="before")
+    @classmethod
+    def to_string(cls, value):
+        return None if value is None else str(value)
+
+
+def parse_json_output(raw: str):
+    """
+    Parses the json object of an LLM answer, tolerating ```json fences and text around it.
+    Returns None if it is not json.
+    """
+    start, end = raw.find("{"), raw.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        return json.loads(raw[start:end + 1])
+    except ValueError:
+        return None
+
+
+REPAIR_PROMPT = """The following answer must be a json object valid against this json schema:
+{schema}
+
+Validation errors:
+{errors}
+
+Answer:
+{raw}
+
+Return only the corrected json object, keep every value that is already present."""
+
+
+def parse_report(raw: str, model, llm=None):
+    """
+    Validates an LLM answer against a report model. If it is not valid and an LLM is given, one short
+    repair call (schema + errors + answer, without the invoice) is made instead of rerunning the crew.
+
+    Parameters:
+    raw (str): The raw answer.
+    model (type): RebateReport or EventReport.
+    llm: The CrewAI LLM used for the repair call, None to disable it.
+
+    Returns:
+    BaseModel: The validated report.
+
+    Raises:
+    ValidationError: If the answer (and its repair) is still invalid.
+    """
+    try:
+        return model.model_validate(parse_json_output(raw))
+    except ValidationError as error:
+        if llm is None:
+            raise
+        errors = error
+
+    prompt = REPAIR_PROMPT.format(
+        schema=json.dumps(model.model_json_schema(), separators=(",", ":")),
+        errors=str(errors),
+        raw=raw
+    )
+    repaired = llm.call([{"role": "user", "content": prompt}])
+    return model.model_validate(parse_json_output(str(repaired)))
+
+
+def to_report(crew_output, model, llm=None):
+    """
+    Returns the typed report of a crew run: the pydantic output when CrewAI could build it,
+    otherwise the raw answer validated (and repaired if needed) with parse_report.
+    """
+    if isinstance(getattr(crew_output, "pydantic", None), model):
+        return crew_output.pydantic
+    return parse_report(crew_output.raw, model, llm)
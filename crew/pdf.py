@@ -0,0 +1,114 @@
+import os
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from crew import tracing
+from crew.utils import file_sha256
+
+CACHE_DIR = os.path.join(".cache", "pdf_text")
+PAGES_PER_CHUNK = 16
+
+
+def _pdf_reader(file):
+    # PyPDF2 is only imported when a PDF is actually parsed (cache hits never need it)
+    import PyPDF2
+    return PyPDF2.PdfReader(file)
+
+
+def iter_pages(file_path: str):
+    """
+    Yields the text of each page of the PDF, one page at a time.
+    """
+    with open(file_path, 'rb') as file:
+        reader = _pdf_reader(file)
+        for page in reader.pages:
+            yield page.extract_text() or ""
+
+
+def page_count(file_path: str) -> int:
+    with open(file_path, 'rb') as file:
+        return len(_pdf_reader(file).pages)
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> list:
+    with open(file_path, 'rb') as file:
+        reader = _pdf_reader(file)
+        return [reader.pages[page_num].extract_text() or "" for page_num in range(start, stop)]
+
+
+def iter_pages_parallel(file_path: str, workers: int = None, pages_per_chunk: int = PAGES_PER_CHUNK, mp_context=None):
+    """
+    Yields the text of each page, in order, while the PDF is parsed by several worker processes.
+
+    The page ranges are handed to the workers chunk by chunk and at most two chunks per worker are
+    in flight, so the first pages are available before the last ones are parsed and memory stays
+    bounded whatever the page count.
+
+    Parameters:
+    file_path (str): Path of the PDF.
+    workers (int): Number of worker processes, the CPU count by default.
+    pages_per_chunk (int): Pages parsed by a worker in one go.
+    mp_context: multiprocessing context of the workers, e.g. spawn when called from a multi-threaded process.
+    """
+    total = page_count(file_path)
+    workers = workers or os.cpu_count() or 1
+    ranges = deque((start, min(start + pages_per_chunk, total)) for start in range(0, total, pages_per_chunk))
+    if len(ranges) <= 1:
+        yield from iter_pages(file_path)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=mp_context) as pool:
+        in_flight = deque()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < 2 * workers:
+                start, stop = ranges.popleft()
+                in_flight.append(pool.submit(_extract_page_range, file_path, start, stop))
+            yield from in_flight.popleft().result()
+
+
+def join_pages(pages) -> str:
+    """
+    Joins page texts in a single pass (no quadratic text += page). Pages are separated by a new line
+    so the last line of a page never runs into the first line of the next one.
+    """
+    return "\n".join(pages)
+
+
+def _cache_path(sha256: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, sha256[:2], f"{sha256}.txt")
+
+
+def extract_pdf(file_path: str, cache_dir: str = CACHE_DIR) -> str:
+    """
+    Returns the text of the PDF. The result is cached on disk under the sha256 of the file content,
+    so unchanged invoices are never parsed twice, whatever their name or location.
+
+    Parameters:
+    file_path (str): Path of the PDF.
+    cache_dir (str): Cache folder, None to disable the cache.
+    """
+    with tracing.span("extract_pdf", file=file_path) as span:
+        if cache_dir is None:
+            text = join_pages(iter_pages(file_path))
+            span.set(chars=len(text))
+            return text
+
+        path = _cache_path(file_sha256(file_path), cache_dir)
+        try:
+            with open(path, encoding="utf-8") as cached:
+                text = cached.read()
+            span.set(cache="hit", chars=len(text))
+            return text
+        except FileNotFoundError:
+            pass
+
+        text = join_pages(iter_pages(file_path))
+        span.set(cache="miss", chars=len(text))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cached:
+            cached.write(text)
+        os.replace(tmp_path, path)
+        return text
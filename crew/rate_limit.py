@@ -0,0 +1,216 @@
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+
+from crew import tracing
+
+DEFAULT_RPM = 60
+DEFAULT_TPM = 60000
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 500
+DEFAULT_MAX_RETRIES = 6
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at capacity per minute.
+    """
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = float(capacity_per_minute)
+        self.tokens = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` tokens are available (0 if they already are).
+        Requests bigger than the bucket are let through once it is full.
+        """
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+def estimate_tokens(messages) -> int:
+    """
+    Estimates the prompt tokens of a string or a list of chat messages.
+    Uses tiktoken when it is installed (it comes with langchain_openai), otherwise ~4 characters per token.
+    """
+    if isinstance(messages, str):
+        text = messages
+    else:
+        text = "\n".join(str(message.get("content", "")) if isinstance(message, dict) else str(message) for message in messages)
+
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    # tiktoken downloads the encoding on first use, which fails on machines without internet access
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    while error is not None:
+        if getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError":
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def retry_after_seconds(error: BaseException):
+    """
+    Reads the server's back-off hint (retry-after-ms / retry-after headers) from a rate limit error.
+    """
+    while error is not None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+        for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+            value = headers.get(header) if hasattr(headers, "get") else None
+            if value is not None:
+                try:
+                    return float(value) * scale
+                except ValueError:
+                    pass
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class RateLimiter:
+    """
+    Keeps LLM traffic inside the deployment quota: requests-per-minute and tokens-per-minute
+    token buckets shared by every thread, plus an adaptive pause after a 429.
+
+    Parameters:
+    rpm (int): Requests per minute allowed by the deployment.
+    tpm (int): Tokens per minute allowed by the deployment.
+    expected_output_tokens (int): Completion tokens reserved per request (Azure counts them against TPM).
+    max_retries (int): Attempts after a 429 before the error is raised.
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM,
+                 expected_output_tokens: int = DEFAULT_EXPECTED_OUTPUT_TOKENS, max_retries: int = DEFAULT_MAX_RETRIES):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.expected_output_tokens = expected_output_tokens
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self, prompt_tokens: int):
+        """
+        Blocks until one request and prompt_tokens + expected_output_tokens fit in the budgets.
+        """
+        amount = prompt_tokens + self.expected_output_tokens
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1, now),
+                    self.tokens.wait_time(amount, now),
+                )
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(amount)
+                    return
+                self.condition.wait(wait)
+
+    def pause(self, seconds: float):
+        """
+        Stops every caller from sending for `seconds` (used when the server answers 429).
+        """
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.condition.notify_all()
+
+    def run(self, send, prompt_tokens: int):
+        """
+        Calls send() inside the budgets, retrying on 429 after the server's retry-after
+        (or an exponential back-off with jitter when the header is missing).
+        """
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            self.acquire(prompt_tokens)
+            tracing.add_count("rate_limit_wait_ms", round((time.monotonic() - start) * 1000, 1))
+            try:
+                return send()
+            except Exception as error:
+                if not is_rate_limit_error(error) or attempt == self.max_retries:
+                    raise
+                delay = retry_after_seconds(error)
+                if delay is None:
+                    delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                self.pause(delay)
+
+    async def arun(self, send, prompt_tokens: int):
+        """
+        Async version of run: send() returns an awaitable, waiting for the budget does not block the event loop.
+        """
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            await asyncio.to_thread(self.acquire, prompt_tokens)
+            tracing.add_count("rate_limit_wait_ms", round((time.monotonic() - start) * 1000, 1))
+            try:
+                return await send()
+            except Exception as error:
+                if not is_rate_limit_error(error) or attempt == self.max_retries:
+                    raise
+                delay = retry_after_seconds(error)
+                if delay is None:
+                    delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                self.pause(delay)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Process-wide limiter configured from LLM_RPM, LLM_TPM and LLM_EXPECTED_OUTPUT_TOKENS.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                rpm=int(os.getenv("LLM_RPM", DEFAULT_RPM)),
+                tpm=int(os.getenv("LLM_TPM", DEFAULT_TPM)),
+                expected_output_tokens=int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", DEFAULT_EXPECTED_OUTPUT_TOKENS)),
+            )
+        return _limiter
+
+
+def rate_limited(llm, limiter: RateLimiter = None):
+    """
+    Routes every call of a CrewAI LLM through the rate limiter and returns the same instance.
+    CrewAI picks a provider class at construction time, so the instance's call is wrapped
+    instead of subclassing LLM.
+    """
+    limiter = limiter or get_rate_limiter()
+    call = llm.call
+
+    def limited_call(messages, *args, **kwargs):
+        return limiter.run(lambda: call(messages, *args, **kwargs), estimate_tokens(messages))
+
+    object.__setattr__(llm, "call", limited_call)
+    return llm
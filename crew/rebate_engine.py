@@ -0,0 +1,147 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from crew import extractors, reference_data, tracing
+from crew.models import InvoiceFields, RebateReport, parse_report
+
+DEFAULT_TOLERANCE = 500.0  # GBP, same rule as the prompt chain in prompt_example.py
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+REQUIRED_FIELDS = ("percentage", "invoice_total", "invoice_month", "mdf_number")
+
+EXTRACTION_PROMPT = """{invoice}
+
+Extract the following from the invoice above and answer with a json object only, valid against this json schema:
+{schema}
+
+- percentage: look under the "line description" column of the table, the percentage number as written.
+- invoice_total: the amount below the column Invoice Total.
+- invoice_month: the month from the net receipts period, full English month name.
+- mdf_number: the MDF number.
+- invoice_number: it's to the right of "Invoice Number", "Numero Fattura" or similar depending on the language."""
+
+
+def extract_fields_llm(text: str, llm) -> InvoiceFields:
+    """
+    Extracts the rebate fields with a single LLM call (json answer validated against InvoiceFields).
+    """
+    prompt = EXTRACTION_PROMPT.format(
+        invoice=text,
+        schema=json.dumps(InvoiceFields.model_json_schema(), separators=(",", ":"))
+    )
+    return parse_report(str(llm.call([{"role": "user", "content": prompt}])), InvoiceFields, llm)
+
+
+def extract_fields(text: str, llm=None, min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> InvoiceFields:
+    """
+    Template extraction first (see crew/extractors.py); the LLM is only called when no template
+    applies or a required field is below min_confidence. Confident template fields are kept and
+    the LLM fills the others.
+    """
+    with tracing.span("engine.extract_fields") as span:
+        result = extractors.extract(text)
+        span.set(template=result.template if result is not None else "none",
+                 score=result.score(REQUIRED_FIELDS) if result is not None else 0.0)
+    if llm is None:
+        return result.fields if result is not None else InvoiceFields()
+    if result is not None and result.score(REQUIRED_FIELDS) >= min_confidence:
+        return result.fields
+
+    llm_fields = extract_fields_llm(text, llm)
+    if result is None:
+        return llm_fields
+
+    merged = {
+        name: value if value is not None and result.confidence.get(name, 0.0) >= min_confidence else getattr(llm_fields, name)
+        for name, value in result.fields.model_dump().items()
+    }
+    return InvoiceFields(**merged)
+
+
+def classify_match(rebate_value, invoice_total, tolerance: float = DEFAULT_TOLERANCE):
+    """
+    Vectorized match status:
+        - Fully Matched: invoice total within +/- tolerance of the rebate value
+        - Partially Matched: invoice total lower than the rebate value
+        - Not Matched: invoice total higher, or a value is missing
+    """
+    rebate_value = np.asarray(rebate_value, dtype=float)
+    invoice_total = np.asarray(invoice_total, dtype=float)
+    return np.select(
+        [np.abs(invoice_total - rebate_value) <= tolerance, invoice_total < rebate_value],
+        ["Fully Matched", "Partially Matched"],
+        "Not Matched"
+    )
+
+
+def net_receipts_long() -> pd.DataFrame:
+    """
+    Net receipts unpivoted to one row per (month, category): columns month_key, category, net_receipt.
+    """
+    net_receipts = reference_data.net_receipts().first_rows().drop(columns=["Month"])
+    long = net_receipts.melt(id_vars="key", var_name="category", value_name="net_receipt")
+    long["net_receipt"] = pd.to_numeric(long["net_receipt"], errors="coerce")
+    return long.rename(columns={"key": "month_key"})
+
+
+RECONCILIATION_COLUMNS = list(RebateReport.model_fields) + ["percentage", "net_receipt", "difference"]
+
+
+def reconcile_rebates(fields: pd.DataFrame, tolerance: float = DEFAULT_TOLERANCE) -> pd.DataFrame:
+    """
+    Calculates and validates rebates for any number of invoices in one pass: one merge with the
+    mapping (rebate name, category), one merge with the unpivoted net receipts (month x category)
+    and the rebate value and match status computed on whole columns.
+
+    Parameters:
+    fields (DataFrame): One row per invoice with the InvoiceFields columns; extra columns are kept.
+    tolerance (float): See classify_match.
+
+    Returns:
+    DataFrame: The input columns plus rebate_name, category, net_receipt, rebate_value, difference
+               (invoice total - rebate value) and match_status, one row per invoice, in the same order.
+    """
+    mapping = reference_data.mapping().first_rows()[["key", "Rebates", "Category"]]
+    mapping = mapping.rename(columns={"key": "mdf_key", "Rebates": "rebate_name", "Category": "category"})
+
+    missing = [name for name in REQUIRED_FIELDS if name not in fields.columns]
+    if missing:
+        raise KeyError(f"Missing invoice field columns: {missing}")
+    fields = fields.reset_index(drop=True)
+    if "invoice_number" not in fields.columns:
+        fields = fields.assign(invoice_number=None)
+    result = fields.drop(columns=["rebate_name", "category", "net_receipt"], errors="ignore").assign(
+        mdf_key=reference_data.normalize_code(fields["mdf_number"]),
+        month_key=fields["invoice_month"].astype(str).str.strip().str.lower(),
+    )
+    # Both sides have one row per key, so the merges keep the invoice order and count
+    result = result.merge(mapping, on="mdf_key", how="left")
+    result = result.merge(net_receipts_long(), on=["month_key", "category"], how="left")
+
+    percentage = pd.to_numeric(result["percentage"], errors="coerce").to_numpy(dtype=float)
+    invoice_total = pd.to_numeric(result["invoice_total"], errors="coerce").to_numpy(dtype=float)
+    rebate_value = percentage / 100.0 * result["net_receipt"].to_numpy(dtype=float)
+    result["rebate_value"] = rebate_value
+    result["difference"] = invoice_total - rebate_value
+    result["match_status"] = classify_match(rebate_value, invoice_total, tolerance)
+
+    return result.drop(columns=["mdf_key", "month_key"])
+
+
+def match_rebates(fields: pd.DataFrame, tolerance: float = DEFAULT_TOLERANCE) -> pd.DataFrame:
+    """
+    Same as reconcile_rebates, restricted to the RebateReport columns.
+    """
+    return reconcile_rebates(fields, tolerance)[list(RebateReport.model_fields)]
+
+
+def match_rebate_invoice(fields: InvoiceFields, tolerance: float = DEFAULT_TOLERANCE) -> RebateReport:
+    """
+    Deterministic calculation, validation and classification of one rebate invoice.
+    rebate_value is None when the MDF number or the (month, category) net receipt is not found.
+    """
+    with tracing.span("engine.rebates"):
+        row = match_rebates(pd.DataFrame([fields.model_dump()]), tolerance).iloc[0]
+    return RebateReport(**{name: None if pd.isna(value) else value for name, value in row.items()})
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from crew import tracing
+from crew.id_index import IdIndex
+
+# pandas and pyarrow are only loaded with the first workbook: reference_version() and the paths are
+# used by the entry points before they know whether there is anything to match
+if TYPE_CHECKING:
+    import pandas as pd
+
+MAPPING_PATH = "docs/rebates/mapping.xlsx"
+NET_RECEIPTS_PATH = "docs/rebates/net_receipts.xlsx"
+SNOWFLAKE_PATH = "docs/events/snowflake.xlsx"
+TIPPS_PATH = "docs/events/tipps.xlsx"
+MAPPING_EVENTS_PATH = "docs/events/mapping_events.xlsx"
+
+REBATE_PATHS = [MAPPING_PATH, NET_RECEIPTS_PATH]
+EVENT_PATHS = [SNOWFLAKE_PATH, TIPPS_PATH, MAPPING_EVENTS_PATH]
+ALL_PATHS = REBATE_PATHS + EVENT_PATHS
+
+
+def normalize_code(series: "pd.Series") -> "pd.Series":
+    """
+    Normalizes numeric-looking identifiers (EAN, MDF Number, Agreement ID) read from Excel:
+    cast to string, strip spaces and drop the ".0" pandas adds when the column is parsed as float.
+    Missing values are kept as None so they never match a lookup.
+    """
+    normalized = (
+        series.astype(str)
+        .str.strip()
+        .str.replace(r'\.0$', '', regex=True)
+    )
+    return normalized.where(series.notna(), None)
+
+
+def normalize_key(value) -> str:
+    """
+    Normalizes a single lookup value the same way normalize_code does for a column.
+    """
+    text = str(value).strip()
+    if text.endswith(".0"):
+        text = text[:-2]
+    return text
+
+
+def json_value(value):
+    """
+    Converts a cell of a loaded workbook to a plain json value: missing values (NaN, NaT, None)
+    become None and numpy scalars the matching Python value.
+    """
+    import pandas as pd
+
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+class ReferenceTable:
+    """
+    A workbook loaded once into memory together with a hash index over its key column.
+
+    Attributes:
+    frame (DataFrame): The normalized sheet.
+    index (dict): Normalized key -> row positions in frame.
+    signature (tuple): (mtime_ns, size) of the source file when it was loaded.
+    """
+
+    def __init__(self, frame: "pd.DataFrame", index: dict, signature: tuple):
+        self.frame = frame
+        self.index = index
+        self.signature = signature
+        self._first_rows = None
+        self._id_index = None
+
+    def lookup(self, key) -> "pd.DataFrame":
+        """
+        Returns every row whose key equals the given (already normalized) key, or an empty frame.
+        """
+        positions = self.index.get(key)
+        if positions is None:
+            return self.frame.iloc[0:0]
+        tracing.add_count("rows_scanned", len(positions))
+        return self.frame.iloc[positions]
+
+    def first_rows(self) -> "pd.DataFrame":
+        """
+        Returns one row per key (the first one, as first() does), with the key in a "key" column.
+        Used to join whole invoices against the sheet in a single merge.
+        """
+        if self._first_rows is None:
+            positions = [rows[0] for rows in self.index.values()]
+            first_rows = self.frame.iloc[positions].reset_index(drop=True)
+            first_rows.insert(0, "key", list(self.index.keys()))
+            self._first_rows = first_rows
+        tracing.add_count("rows_scanned", len(self._first_rows))
+        return self._first_rows
+
+    def id_index(self) -> IdIndex:
+        """
+        Prefix and fuzzy index over the keys, built on first use and kept as long as this version of the workbook.
+        """
+        if self._id_index is None:
+            self._id_index = IdIndex(self.index.keys())
+        return self._id_index
+
+    def first(self, key):
+        """
+        Returns the first row for the key as a Series, or None if the key is not indexed.
+        """
+        positions = self.index.get(key)
+        if positions is None:
+            return None
+        tracing.add_count("rows_scanned", 1)
+        return self.frame.iloc[positions[0]]
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def file_signature(file_path: str) -> tuple:
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def reference_version(paths=ALL_PATHS) -> str:
+    """
+    Short hash identifying the current version of the reference workbooks (path, mtime and size of
+    each one that exists). Anything derived from the reference data can be keyed on it.
+    """
+    digest = hashlib.sha256()
+    for file_path in paths:
+        try:
+            mtime_ns, size = file_signature(file_path)
+        except FileNotFoundError:
+            continue
+        digest.update(f"{file_path}:{mtime_ns}:{size};".encode())
+    return digest.hexdigest()[:16]
+
+
+def _build_index(keys: "pd.Series") -> dict:
+    return {key: list(positions) for key, positions in keys.groupby(keys, sort=False).indices.items()}
+
+
+def _load(file_path: str, prepare) -> ReferenceTable:
+    """
+    Returns the cached table for file_path, re-reading the snapshot only when the workbook's mtime or size changed.
+
+    Parameters:
+    file_path (str): Path of the workbook.
+    prepare (callable): Receives the raw DataFrame and returns (normalized frame, key Series).
+    """
+    signature = file_signature(file_path)
+    with _lock:
+        cached = _cache.get(file_path)
+        if cached is not None and cached.signature == signature:
+            return cached
+
+    from crew import snapshot
+
+    with tracing.span("workbook.load", file=file_path, cache="miss") as span:
+        # Served from the Arrow snapshot, which is only rebuilt when the workbook changed
+        df = snapshot.read_frame(file_path)
+        df, keys = prepare(df)
+        table = ReferenceTable(df.reset_index(drop=True), _build_index(keys.reset_index(drop=True)), signature)
+        span.set(rows=len(table.frame))
+
+    with _lock:
+        _cache[file_path] = table
+    return table
+
+
+def _require_columns(df: "pd.DataFrame", columns: set, sheet: str):
+    missing_columns = columns - set(df.columns)
+    if missing_columns:
+        raise KeyError(f"Missing columns in {sheet} file: {', '.join(sorted(missing_columns))}")
+
+
+def _prepare_mapping(df):
+    _require_columns(df, {"MDF Number"}, "Mapping")
+    df['MDF Number'] = normalize_code(df['MDF Number'])
+    df = df.dropna(subset=['MDF Number'])
+    return df, df['MDF Number']
+
+
+def _prepare_net_receipts(df):
+    _require_columns(df, {"Month"}, "Net Receipts")
+    df = df.dropna(subset=['Month'])
+    return df, df['Month'].astype(str).str.strip().str.lower()
+
+
+def _prepare_snowflake(df):
+    _require_columns(df, {"ASIN", "EAN_UPC"}, "Snowflake")
+    df['EAN_UPC'] = normalize_code(df['EAN_UPC'])
+    df = df.dropna(subset=['ASIN'])
+    return df, df['ASIN'].astype(str).str.strip().str.lower()
+
+
+def _prepare_tipps(df):
+    _require_columns(df, {"Consumer Unit EAN/UPC Code", "PROMO DISCOUNT £"}, "TIPPS")
+    df['Consumer Unit EAN/UPC Code'] = normalize_code(df['Consumer Unit EAN/UPC Code'])
+    df = df.dropna(subset=['Consumer Unit EAN/UPC Code'])
+    return df, df['Consumer Unit EAN/UPC Code']
+
+
+def _prepare_mapping_events(df):
+    _require_columns(df, {"Agreement ID", "Event Description", "Event ID"}, "Mapping Events")
+    df['Agreement ID'] = normalize_code(df['Agreement ID'])
+    df = df.dropna(subset=['Agreement ID'])
+    return df, df['Agreement ID']
+
+
+def mapping(file_path: str = MAPPING_PATH) -> ReferenceTable:
+    """Rebate mapping sheet indexed by MDF Number."""
+    return _load(file_path, _prepare_mapping)
+
+
+def net_receipts(file_path: str = NET_RECEIPTS_PATH) -> ReferenceTable:
+    """Net receipts sheet indexed by lowercased Month."""
+    return _load(file_path, _prepare_net_receipts)
+
+
+def snowflake(file_path: str = SNOWFLAKE_PATH) -> ReferenceTable:
+    """Snowflake extract indexed by lowercased ASIN."""
+    return _load(file_path, _prepare_snowflake)
+
+
+def tipps(file_path: str = TIPPS_PATH) -> ReferenceTable:
+    """TIPPS promo sheet indexed by normalized EAN."""
+    return _load(file_path, _prepare_tipps)
+
+
+def mapping_events(file_path: str = MAPPING_EVENTS_PATH) -> ReferenceTable:
+    """Events mapping sheet indexed by normalized Agreement ID."""
+    return _load(file_path, _prepare_mapping_events)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,207 @@
+import glob
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from crew import reference_data, tracing
+from crew.batch import batch_concurrency
+
+DOCS_DIR = "docs"
+
+# Invoice kind -> (folder of its reference workbooks, the workbooks, their loaders)
+KINDS = {
+    "rebates": ("docs/rebates", reference_data.REBATE_PATHS, (reference_data.mapping, reference_data.net_receipts)),
+    "events": ("docs/events", reference_data.EVENT_PATHS,
+               (reference_data.snowflake, reference_data.tipps, reference_data.mapping_events)),
+}
+# Rebate invoices are short and usually urgent at month end, so they go first by default
+DEFAULT_PRIORITY = {"rebates": 10, "events": 0}
+
+
+def classify_pdf(path: str):
+    """
+    Returns "rebates" or "events" for an invoice, or None when it looks like neither.
+
+    Invoices in docs/rebates and docs/events are of that kind; in any other folder (e.g. one per vendor)
+    the text decides: line items with ASINs make an event invoice, an MDF number read by a rebate
+    template makes a rebate invoice. The text comes from the PDF cache, so it is parsed once.
+    """
+    folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    if folder in KINDS:
+        return folder
+
+    from crew import extractors
+    from crew.events_engine import ASIN_PATTERN
+    from crew.pdf import extract_pdf
+
+    text = extract_pdf(path)
+    if ASIN_PATTERN.search(text):
+        return "events"
+    extraction = extractors.extract(text)
+    if extraction is not None and extraction.fields.mdf_number:
+        return "rebates"
+    return None
+
+
+def scan(docs_dir: str = DOCS_DIR) -> tuple:
+    """
+    Classifies every PDF of docs/*/. Returns ({kind: [paths]}, [paths of unclassified PDFs]).
+    """
+    invoices = {kind: [] for kind in KINDS}
+    unclassified = []
+    for path in sorted(glob.glob(os.path.join(docs_dir, "*", "*"))):
+        if not path.lower().endswith(".pdf"):
+            continue
+        kind = classify_pdf(path)
+        if kind is None:
+            unclassified.append(path)
+        else:
+            invoices[kind].append(path)
+    return invoices, unclassified
+
+
+def group_priority(kind: str) -> int:
+    return int(os.getenv(f"SCHEDULER_PRIORITY_{kind.upper()}", DEFAULT_PRIORITY.get(kind, 0)))
+
+
+def group_concurrency(kind: str, workers: int) -> int:
+    """
+    Invoices of one group matched at the same time, SCHEDULER_CONCURRENCY_<KIND>. By default a group
+    can use every worker but one, so another group always gets a worker while it runs.
+    """
+    return max(1, min(workers, int(os.getenv(f"SCHEDULER_CONCURRENCY_{kind.upper()}", max(1, workers - 1)))))
+
+
+@dataclass
+class InvoiceGroup:
+    """
+    Invoices matched against the same reference workbooks.
+
+    Parameters:
+    kind (str): "rebates" or "events".
+    invoices (list): Paths of the PDFs to match.
+    match (callable): (path, text) -> result, text is None for the paths in stream.
+    prepare (callable): Loads the group's workbooks, run once before its first invoice.
+    priority (int): Groups with a higher priority get the free workers first.
+    concurrency (int): Maximum number of the group's invoices matched at the same time.
+    stream (set): Paths matched without extracting their text first (very large PDFs read page by page).
+    """
+    kind: str
+    invoices: list
+    match: callable
+    prepare: callable = None
+    priority: int = 0
+    concurrency: int = 1
+    stream: set = field(default_factory=set)
+    running: int = 0
+    ready: list = field(default_factory=list)
+    prepared: bool = False
+    error: BaseException = None
+
+
+def load_workbooks(kind: str):
+    """
+    Builds the missing or stale snapshots of the kind's workbooks and loads them into memory, so the
+    invoices of the group all share one load.
+    """
+    from crew import snapshot
+
+    folder, _, loaders = KINDS[kind]
+    with tracing.span("group.prepare", kind=kind):
+        snapshot.compile_snapshots([folder])
+        for loader in loaders:
+            loader()
+
+
+def _next_group(groups: list):
+    # Highest priority first; between groups of equal priority the one with the fewest running invoices
+    candidates = [group for group in groups if group.prepared and group.ready and group.running < group.concurrency]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda group: (group.priority, -group.running))
+
+
+def run_groups(groups: list, extract, workers: int = None):
+    """
+    Matches the invoices of several groups on one shared pool and yields each result as soon as it is ready.
+
+    Every group's workbooks are loaded once, before its first invoice. PDFs are extracted in a process
+    pool, then each free worker takes an invoice of the group with the highest priority that is below
+    its own concurrency, so a large group cannot hold every worker while another one is waiting.
+    Each invoice is one trace whose "invoice" root span covers extraction and matching.
+
+    Parameters:
+    groups (list): InvoiceGroups.
+    extract (callable): Module-level function path -> invoice text (it must be picklable).
+    workers (int): Invoices matched at the same time across all groups, BATCH_CONCURRENCY by default.
+
+    Yields:
+    tuple: (group, pdf_path, result, error) in completion order; error is the raised exception or None.
+    """
+    workers = workers or batch_concurrency()
+    groups = [group for group in groups if group.invoices]
+    if not groups:
+        return
+
+    extracted = [path for group in groups for path in group.invoices if path not in group.stream]
+    extract_workers = max(1, min(workers, os.cpu_count() or 1, len(extracted)))
+    # The prepare threads import pandas/pyarrow while the extract workers start: fork could copy a held lock
+    extract_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=extract_workers, mp_context=extract_context) as extract_pool, \
+            ThreadPoolExecutor(max_workers=workers) as match_pool:
+        spans = {}
+        pending = {}
+        for group in sorted(groups, key=lambda group: -group.priority):
+            if group.prepare is not None:
+                pending[match_pool.submit(group.prepare)] = ("prepare", group, None)
+            else:
+                group.prepared = True
+            for path in group.invoices:
+                spans[path] = tracing.start_span("invoice", invoice=path, kind=group.kind, priority=group.priority)
+                if path in group.stream:
+                    group.ready.append((path, None))
+                else:
+                    pending[extract_pool.submit(tracing.run_traced, spans[path].context(), extract, path)] = ("extract", group, path)
+
+        running = 0
+        while True:
+            group = _next_group(groups)
+            while group is not None and running < workers:
+                path, text = group.ready.pop(0)
+                pending[match_pool.submit(tracing.run_in_span, spans[path], group.match, path, text)] = ("match", group, path)
+                group.running += 1
+                running += 1
+                group = _next_group(groups)
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, group, path = pending.pop(future)
+                error = future.exception()
+
+                if stage == "prepare":
+                    group.prepared = True
+                    group.error = error
+                    if error is not None:
+                        # Without its workbooks no invoice of the group can be matched
+                        for path, _ in group.ready:
+                            spans.pop(path).end(error)
+                            yield group, path, None, error
+                        group.ready = []
+                    continue
+
+                if stage == "extract":
+                    if error is None and group.error is None:
+                        text, records = future.result()
+                        tracing.export_records(records)
+                        group.ready.append((path, text))
+                        continue
+                    error = error or group.error
+                else:
+                    group.running -= 1
+                    running -= 1
+
+                spans.pop(path).end(error)
+                yield group, path, None if error is not None else future.result(), error
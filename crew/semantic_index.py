@@ -0,0 +1,149 @@
+import hashlib
+import os
+import threading
+
+import pandas as pd
+
+from crew import reference_data, tracing
+
+INDEX_PATH = os.path.join(".cache", "chroma")
+DEFAULT_TOP_K = 5
+BATCH_SIZE = 1000
+
+
+def _mapping_row(row) -> tuple:
+    text = " | ".join(str(row[column]) for column in ("Rebates", "Category") if pd.notna(row.get(column)))
+    return text, {"rebate_name": row.get("Rebates"), "category": row.get("Category"), "mdf_number": row["MDF Number"]}
+
+
+def _mapping_events_row(row) -> tuple:
+    return str(row["Event Description"]), {
+        "agreement_id": row["Agreement ID"],
+        "event_description": row["Event Description"],
+        "event_id": row["Event ID"],
+    }
+
+
+# Collection name -> (loader of the workbook, row -> (embedded text, metadata returned to the agent))
+SHEETS = {
+    "mapping": (reference_data.mapping, _mapping_row),
+    "mapping_events": (reference_data.mapping_events, _mapping_events_row),
+}
+
+
+def _metadata(values: dict) -> dict:
+    # Chroma metadata only takes str, int, float and bool values
+    metadata = {}
+    for key, value in values.items():
+        value = reference_data.json_value(value)
+        if value is None:
+            continue
+        metadata[key] = value if isinstance(value, (str, int, float, bool)) else str(value)
+    return metadata
+
+
+def _row_id(text: str, metadata: dict) -> str:
+    # Content hash: an unchanged row keeps its id, so only new or edited rows are embedded again
+    payload = text + "\x1f" + "\x1f".join(f"{key}={value}" for key, value in sorted(metadata.items()))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class SemanticIndex:
+    """
+    Persistent HNSW index (Chroma) of the rows of the mapping sheets, embedded with a local model, for
+    finding a row from the vendor's wording of a rebate or event when the MDF number does not match.
+
+    Each sheet is a collection kept in sync with its workbook: on the first query after a change,
+    rows whose content is new are embedded and added and rows that disappeared are deleted, the
+    others are left as they are. The signature of the synced workbook is stored with the collection,
+    so an unchanged workbook is not re-read after a restart.
+
+    Parameters:
+    path (str): Directory of the Chroma database.
+    embedding_function: Chroma embedding function, by default Chroma's local ONNX all-MiniLM-L6-v2
+    (downloaded once to ~/.cache/chroma).
+    """
+
+    def __init__(self, path: str = INDEX_PATH, embedding_function=None):
+        import chromadb
+        from chromadb.config import Settings
+        from chromadb.utils import embedding_functions
+
+        self.path = path
+        self.embedding_function = embedding_function or embedding_functions.DefaultEmbeddingFunction()
+        self.client = chromadb.PersistentClient(path=path, settings=Settings(anonymized_telemetry=False))
+        self.locks = {name: threading.Lock() for name in SHEETS}
+        self.synced = {}
+
+    def collection(self, name: str):
+        return self.client.get_or_create_collection(
+            name, embedding_function=self.embedding_function, metadata={"hnsw:space": "cosine"}
+        )
+
+    def sync(self, name: str):
+        """
+        Brings the collection up to date with its workbook and returns it.
+        """
+        load, to_document = SHEETS[name]
+        table = load()
+        signature = f"{table.signature[0]}:{table.signature[1]}"
+
+        with self.locks[name]:
+            collection = self.collection(name)
+            if self.synced.get(name) == signature or (collection.metadata or {}).get("source_signature") == signature:
+                self.synced[name] = signature
+                return collection
+
+            with tracing.span("semantic.sync", sheet=name, rows=len(table.frame)) as span:
+                documents = {}
+                for _, row in table.frame.iterrows():
+                    text, metadata = to_document(row)
+                    metadata = _metadata(metadata)
+                    documents[_row_id(text, metadata)] = (text, metadata)
+
+                existing = set(collection.get(include=[])["ids"])
+                added = [row_id for row_id in documents if row_id not in existing]
+                removed = [row_id for row_id in existing if row_id not in documents]
+                for start in range(0, len(removed), BATCH_SIZE):
+                    collection.delete(ids=removed[start:start + BATCH_SIZE])
+                for start in range(0, len(added), BATCH_SIZE):
+                    batch = added[start:start + BATCH_SIZE]
+                    collection.add(
+                        ids=batch,
+                        documents=[documents[row_id][0] for row_id in batch],
+                        metadatas=[documents[row_id][1] for row_id in batch],
+                    )
+                collection.modify(metadata={"source_signature": signature})
+                span.set(added=len(added), removed=len(removed))
+
+            self.synced[name] = signature
+            return collection
+
+    def query(self, name: str, text: str, k: int = DEFAULT_TOP_K) -> list:
+        """
+        The k rows of the sheet closest in meaning to the text, best first: their metadata plus
+        "score", the cosine similarity (1 is the same meaning).
+        """
+        collection = self.sync(name)
+        if collection.count() == 0:
+            return []
+        result = collection.query(query_texts=[text], n_results=min(k, collection.count()), include=["metadatas", "distances"])
+        return [
+            {**{key: metadata[key] for key in sorted(metadata)}, "score": round(1 - distance, 3)}
+            for metadata, distance in zip(result["metadatas"][0], result["distances"][0])
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_semantic_index() -> SemanticIndex:
+    """
+    Process-wide index stored in SEMANTIC_INDEX_PATH (.cache/chroma by default).
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SemanticIndex(os.getenv("SEMANTIC_INDEX_PATH", INDEX_PATH))
+        return _index
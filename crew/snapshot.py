@@ -0,0 +1,141 @@
+import glob
+import json
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+
+from crew.utils import file_sha256
+
+SNAPSHOT_DIR = ".snapshots"
+SOURCE_DIRS = ["docs/rebates", "docs/events"]
+
+_METADATA_KEY = b"invoice_matching.source"
+
+
+def snapshot_path(source_path: str) -> str:
+    """
+    Returns where the Arrow snapshot of a workbook lives: docs/<kind>/.snapshots/<name>.arrow
+    """
+    folder, name = os.path.split(source_path)
+    return os.path.join(folder, SNAPSHOT_DIR, os.path.splitext(name)[0] + ".arrow")
+
+
+def _source_info(source_path: str) -> dict:
+    stat = os.stat(source_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _read_metadata(path: str):
+    try:
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if _METADATA_KEY not in metadata:
+        return None
+    return json.loads(metadata[_METADATA_KEY])
+
+
+def _to_arrow(df: pd.DataFrame) -> pa.Table:
+    # Excel columns often mix numbers and text (e.g. MDF Number), which Arrow cannot type.
+    # Those columns are stored as strings, keeping missing values as nulls.
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        try:
+            columns[str(name)] = pa.array(column, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[str(name)] = pa.array(column.astype(str).where(column.notna(), None), type=pa.string())
+    return pa.table(columns)
+
+
+def _write_table(table: pa.Table, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file of its own first (threads of one process may write the same snapshot),
+    # so a concurrent reader never maps a half-written snapshot
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(source_path: str, sha256: str = None) -> str:
+    """
+    Parses the workbook once with openpyxl and writes it as an uncompressed Arrow IPC file,
+    tagged with the source mtime, size and content hash.
+
+    Returns:
+    str: The snapshot path.
+    """
+    df = pd.read_excel(source_path, engine='openpyxl')
+    table = _to_arrow(df)
+
+    info = _source_info(source_path)
+    info["sha256"] = sha256 or file_sha256(source_path)
+    table = table.replace_schema_metadata({_METADATA_KEY: json.dumps(info)})
+
+    path = snapshot_path(source_path)
+    _write_table(table, path)
+    return path
+
+
+def ensure_snapshot(source_path: str) -> str:
+    """
+    Returns an up-to-date snapshot for the workbook, rebuilding it only when the source changed.
+    A touched but otherwise identical workbook is detected by its content hash and only re-tagged.
+    """
+    path = snapshot_path(source_path)
+    metadata = _read_metadata(path)
+    info = _source_info(source_path)
+
+    if metadata is not None:
+        if metadata["mtime_ns"] == info["mtime_ns"] and metadata["size"] == info["size"]:
+            return path
+
+        sha256 = file_sha256(source_path)
+        if metadata.get("sha256") == sha256:
+            table = read_table(path).replace_schema_metadata({_METADATA_KEY: json.dumps({**info, "sha256": sha256})})
+            _write_table(table, path)
+            return path
+        return build_snapshot(source_path, sha256)
+
+    return build_snapshot(source_path)
+
+
+def read_table(path: str) -> pa.Table:
+    """
+    Opens a snapshot through a memory map, so the column buffers are not copied into the process.
+    """
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_frame(source_path: str) -> pd.DataFrame:
+    """
+    Returns the workbook contents as a DataFrame, served from its Arrow snapshot.
+    Drop-in replacement for pd.read_excel(source_path, engine='openpyxl').
+    """
+    table = read_table(ensure_snapshot(source_path))
+    return table.to_pandas()
+
+
+def compile_snapshots(source_dirs=SOURCE_DIRS) -> list:
+    """
+    Builds or refreshes the snapshot of every workbook found in the given folders.
+    """
+    paths = []
+    for folder in source_dirs:
+        for source_path in sorted(glob.glob(os.path.join(folder, "*.xlsx"))):
+            if os.path.basename(source_path).startswith("~$"):  # Excel lock files
+                continue
+            paths.append(ensure_snapshot(source_path))
+    return paths
+
+
+if __name__ == '__main__':
+    for path in compile_snapshots():
+        print(path)
@@ -1,6 +1,8 @@
 from crewai import Task
 from textwrap import dedent
 
+from crew.models import RebateReport, EventReport
+
 def amazon_invoice_matching_rebate(agent):
     return Task(
         description=dedent(
@@ -19,6 +21,7 @@ def amazon_invoice_matching_rebate(agent):
 
             - Tools to Use:
                 - query_mapping: For finding rebate categories
+                - search_mapping_semantic: Only when query_mapping finds no match, for finding the rebate from its description
                 - query_net_receipts: For retrieving net receipt values
                 - calculate_rebate_value: For computing rebate amounts
                 
@@ -32,10 +35,11 @@ def amazon_invoice_matching_rebate(agent):
             2. *Rebate Mapping* (use tool query_mapping):
                 - Use MDF number to find corresponding Rebate Name (Column A) on column name Rebates
                 - Identify category on the Column name Category from mapping (Column C)
+                - If no row matches the MDF number, call search_mapping_semantic ONCE with the rebate description of the invoice and use the best candidate that fits the invoice
 
             3. *Data Retrieval* (use query_net_receipts and calculate_rebate_value):
                 - Get net receipt value using Category and Invoice Month
-                - Calculate rebate value (Percentage * Net Receipt), don't change the percentage found in the Invoice Document
+                - Calculate rebate value (Percentage / 100 * Net Receipt) with calculate_rebate_value, passing the percentage as written in the Invoice Document (2.5 for 2.5%)
 
             4. *Validation*:
                 - Compare calculated rebate value with invoice total
@@ -66,7 +70,8 @@ def amazon_invoice_matching_rebate(agent):
             match_status: Fully/Partially/Not Matched
             
         """,
-        agent=agent
+        agent=agent,
+        output_pydantic=RebateReport
     )
 
 def amazon_invoice_matching_event(agent):
@@ -87,20 +92,23 @@ def amazon_invoice_matching_event(agent):
                 - Extract MDF number from the invoice and search for its corresponding Event Description and Event ID in mapping.
 
             - Tools to Use:
-                - query_snowflake: For finding EAN codes based on ASINs
-                - query_tipps: For retrieving promo discounts based on EAN codes
+                - query_snowflake_batch: For finding the EAN codes and promo discounts of all ASINs in a single call
+                - query_tipps_batch: For retrieving promo discounts of several EAN codes in a single call
                 - query_mapping_events: For finding Event Description and Event ID based on Agreement ID
+                - search_events_semantic: Only when query_mapping_events finds no match, for finding the event from its description
 
             ### Required Steps:
             1. *Invoice Analysis*:
                 - Identify ASIN numbers, rebate per unit, and line totals from the invoice.
                 - Create a table with three columns: ASIN, Rebate Per Unit, Line Total.
 
-            2. *EAN Lookup* (use tool query_snowflake):
-                - For each ASIN, find the corresponding EAN and add a new column to the table.
+            2. *EAN Lookup* (use tool query_snowflake_batch):
+                - Call query_snowflake_batch ONCE with the list of all ASINs of the table.
+                - Add the returned ean and promo_discount columns to the table. "NOT FOUND" means there is no EAN (or no promo) for that ASIN.
 
-            3. *Promo Discount Lookup* (use tool query_tipps):
-                - For each EAN, find the corresponding tipps promo discount and add this as a new column.
+            3. *Promo Discount Lookup* (use tool query_tipps_batch only if needed):
+                - Only if you have EANs whose promo discount is still unknown, call query_tipps_batch ONCE with the list of those EANs.
+                - Do not call a lookup tool once per row.
 
             4. *Comparison*:
                 - Compare values in the Rebate Per Unit column to the Promo Discount column.
@@ -110,6 +118,7 @@ def amazon_invoice_matching_event(agent):
                 - Extract the MDF number from the invoice.
                 - Search for it in the mapping.
                 - If a match is found, retrieve the corresponding Event Description and Event ID.
+                - If none is found, call search_events_semantic ONCE with the event description of the invoice and use the best candidate that fits the invoice.
 
             ### Expected Output:
             A structured report containing:
@@ -141,5 +150,6 @@ def amazon_invoice_matching_event(agent):
             *Required Format*:
             json
         """,
-        agent=agent
+        agent=agent,
+        output_pydantic=EventReport
     )
\ No newline at end of file
@@ -0,0 +1,19 @@
+import os
+
+# Read by CrewAI (and the OpenTelemetry SDK it bundles) each time it would send an event
+TELEMETRY_FLAGS = {
+    "CREWAI_DISABLE_TELEMETRY": "true",
+    "CREWAI_DISABLE_TRACKING": "true",
+    "CREWAI_TRACING_ENABLED": "false",
+    "OTEL_SDK_DISABLED": "true",
+}
+
+
+def disable_crewai_telemetry():
+    """
+    Turns off CrewAI's anonymous telemetry and trace upload through its environment flags, so it works
+    before crewai is imported and costs nothing when no crew runs. A flag already set (e.g. in .env)
+    is left as it is.
+    """
+    for name, value in TELEMETRY_FLAGS.items():
+        os.environ.setdefault(name, value)
@@ -0,0 +1,58 @@
+import functools
+import json
+import threading
+
+from crew import tracing
+from crew.rate_limit import estimate_tokens
+
+_lock = threading.Lock()
+_calls = {}
+
+
+def track_tokens(func):
+    """
+    Records, for every call of a tool, the size of its output in characters and estimated tokens,
+    and traces the call as a "tool.<name>" span (crew/tracing.py).
+    Placed under @tool so the agent-facing signature and docstring are unchanged.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        input_tokens = estimate_tokens(json.dumps([args, kwargs], default=str))
+        with tracing.span(f"tool.{func.__name__}", **{"gen_ai.usage.input_tokens": input_tokens}) as span:
+            output = func(*args, **kwargs)
+            text = str(output)
+            tokens = estimate_tokens(text)
+            span.set(**{"gen_ai.usage.output_tokens": tokens})
+        with _lock:
+            stats = _calls.setdefault(func.__name__, {"calls": 0, "chars": 0, "tokens": 0})
+            stats["calls"] += 1
+            stats["chars"] += len(text)
+            stats["tokens"] += tokens
+        return output
+    return wrapper
+
+
+def tool_report() -> dict:
+    """
+    Returns {tool name: {"calls", "chars", "tokens", "tokens_per_call"}} for this process.
+    """
+    with _lock:
+        return {
+            name: {**stats, "tokens_per_call": round(stats["tokens"] / stats["calls"], 1)}
+            for name, stats in _calls.items()
+        }
+
+
+def format_tool_report() -> str:
+    report = tool_report()
+    if not report:
+        return "No tool calls."
+    lines = [f"{'tool':<24}{'calls':>8}{'chars':>10}{'tokens':>10}{'tok/call':>10}"]
+    for name, stats in sorted(report.items()):
+        lines.append(f"{name:<24}{stats['calls']:>8}{stats['chars']:>10}{stats['tokens']:>10}{stats['tokens_per_call']:>10}")
+    return "\n".join(lines)
+
+
+def reset():
+    with _lock:
+        _calls.clear()
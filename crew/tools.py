@@ -1,55 +1,116 @@
+import json
+
 import pandas as pd
 from crewai.tools import tool
 
+from crew import reference_data, semantic_index
+from crew.token_report import track_tokens
+
+MAX_TOOL_ROWS = 5
+MAX_BATCH_ROWS = 500
+
+def _compact(value) -> str:
+    """
+    Serializes a tool result as compact json (no spaces), the cheapest stable form for the agent to read.
+    """
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
 @tool("query_mapping")
+@track_tokens
 def query_mapping(mdf_number: str):
     """
-    This function takes a rebate name as input and returns the corresponding row(s) from an Excel file containing rebate mappings.
+    This function takes an MDF number as input and returns the matching rebate(s) from the rebate mapping Excel file.
 
     Parameters:
-    mdf_number (str): The name of the rebate to search for in the Excel file.
+    mdf_number (str): The MDF number from the invoice.
 
     Returns:
-    Markdown Table (str): A markdown Table containing the row(s) from the Excel file where the 'Rebates' column matches the provided rebate name (case-insensitive).
+    Json (str): {"matches": [{"rebate_name", "category", "mdf_number"}], "truncated": bool}, with at most 5 rows
+    whose 'MDF Number' equals the provided MDF number. When there is none, the closest MDF numbers
+    (partial number or misread digits) are returned best first, each with "match" ("prefix" or "fuzzy")
+    and "score" (0 to 1): check them against the invoice before using one. "matches" is empty if nothing is close.
     """
     
-    file_path = "docs/rebates/mapping.xlsx"
-    df = pd.read_excel(file_path, engine='openpyxl')
-    
-    # Convert 'MDF Number' column to strings to better match the number
-    df['MDF Number'] = df['MDF Number'].astype(str)
-        
-    result = df[df['MDF Number'].apply(lambda x: mdf_number in x)]
+    table = reference_data.mapping()
+    mdf_number = reference_data.normalize_key(mdf_number)
     
-    return result.to_markdown(index=False) # Convert Data Frame to Markdown for the Agent understand better
+    # Exact hit on the MDF index, only the columns the agent needs
+    result = table.lookup(mdf_number)
+    matches = [_mapping_match(row) for _, row in result.head(MAX_TOOL_ROWS).iterrows()]
+    if matches:
+        return _compact({"matches": matches, "truncated": len(result) > MAX_TOOL_ROWS})
+
+    # Ranked prefix / OCR / edit-distance candidates (crew/id_index.py)
+    candidates = table.id_index().search(mdf_number, MAX_TOOL_ROWS)
+    matches = [
+        {**_mapping_match(table.first(candidate["key"])), "match": candidate["match"], "score": candidate["score"]}
+        for candidate in candidates
+    ]
+    return _compact({"matches": matches, "truncated": False})
+
+def _mapping_match(row) -> dict:
+    return {
+        "rebate_name": reference_data.json_value(row.get("Rebates")),
+        "category": reference_data.json_value(row.get("Category")),
+        "mdf_number": row["MDF Number"],
+    }
+
+@tool("search_mapping_semantic")
+@track_tokens
+def search_mapping_semantic(description: str):
+    """
+    Fallback of query_mapping for when the MDF number finds no rebate: searches the rebate mapping Excel file
+    by meaning, for a vendor wording of the rebate that differs from the sheet.
+
+    Parameters:
+    description (str): The rebate description from the invoice line (e.g. "Co-op marketing allowance - Beauty").
+
+    Returns:
+    Json (str): {"matches": [{"rebate_name", "category", "mdf_number", "score"}]}, the 5 closest rows best first,
+    score being the similarity from 0 to 1. Check the best one against the invoice before using it; do not call again
+    with the same description.
+    """
+    try:
+        matches = semantic_index.get_semantic_index().query("mapping", description, MAX_TOOL_ROWS)
+    except FileNotFoundError:
+        return _compact({"error": "Mapping Excel file not found."})
+    except Exception as e:
+        return _compact({"error": f"Semantic search unavailable: {e}"})
+    return _compact({"matches": matches})
 
 @tool("query_net_receipts")
+@track_tokens
 def query_net_receipts(rebate_category: str, date_month: str):
     """
-    This function takes a rebate category and a month as input and returns the corresponding row(s) from an Excel file containing net receipts data.
+    This function takes a rebate category and a month as input and returns the net receipt value for them from the net receipts Excel file.
 
     Parameters:
     rebate_category (str): The category of the rebate to search for in the Excel file.
     date_month (str): The month to filter the data by. Month should not be an abbreviation, it must be the complete month name.
 
     Returns:
-    Markdown Table (str): A markdown Table containing the row(s) from the Excel file where the 'Month' column matches the provided date_month (case-insensitive) and includes only the 'Month' and specified rebate_category columns.
+    Json (str): {"month", "category", "net_receipt"}, the value at the intersection of the month row (case-insensitive)
+    and the category column, or {"error": ...} if the month or the category does not exist.
     """
-    file_path = "docs/rebates/net_receipts.xlsx"
-    df = pd.read_excel(file_path, engine='openpyxl') 
+    table = reference_data.net_receipts()
     
-    # Filter the DataFrame by the given rebate category and month
-    result = df[df["Month"].str.lower() == date_month.lower()][["Month", rebate_category]]
-    return result.to_markdown(index=False) # Convert Data Frame to Markdown for the Agent understand better
+    # Only the (month, category) cell is returned, not the whole month row
+    row = table.first(date_month.strip().lower())
+    if row is None:
+        return _compact({"error": f"No net receipts for month: {date_month}"})
+    if rebate_category not in row.index:
+        return _compact({"error": f"No net receipts column for category: {rebate_category}"})
+    return _compact({"month": row["Month"], "category": rebate_category, "net_receipt": reference_data.json_value(row[rebate_category])})
 
 @tool("calculate_rebate_value")
+@track_tokens
 def calculate_rebate_value(net_receipt_category_value, invoice_percentage):
     """
-    This function calculates (invoice_percentage * net_receipt_category_value) the rebate value based on the given percentage value and net receipts.
+    This function calculates (invoice_percentage / 100 * net_receipt_category_value) the rebate value based on the given percentage value and net receipts.
 
     Parameters:
     net_receipt_category_value (float): The net receipt value for the Category.
-    invoice_percentage (float): The percentage value to be used in the calculation, don't adapt the value
+    invoice_percentage (float): The percentage as written on the invoice (2.5 for 2.5%), don't adapt the value
     
     Returns:
     Float: Return Rebate Value.
@@ -57,9 +118,11 @@ def calculate_rebate_value(net_receipt_category_value, invoice_percentage):
     
     value = float(net_receipt_category_value)
     percentage =  float(invoice_percentage)
-    return percentage * value
+    # Same convention as crew/rebate_engine.py: the percentage is passed as written, e.g. 2.5 for 2.5%
+    return percentage / 100.0 * value
 
 @tool("validate_rebate_value")
+@track_tokens
 def validate_rebate_value(rebate_value, invoice_total_value):
     """
     Validates if the rebate value is within an acceptable range compared to the total invoice value.
@@ -80,6 +143,7 @@ def validate_rebate_value(rebate_value, invoice_total_value):
         return "Invalid"
 
 @tool("query_snowflake")
+@track_tokens
 def query_snowflake(asin: str):
     """
     This function retrieves the EAN code associated with a given ASIN from the Snowflake Excel file.
@@ -91,32 +155,20 @@ def query_snowflake(asin: str):
     Returns:
     str: The EAN code found in the Excel file or an appropriate message.
     """
-    file_path = "docs/events/snowflake.xlsx"
-
     try:
-        # Load the Excel file safely
-        df = pd.read_excel(file_path, engine='openpyxl')
-
-        # Debug: Print column names to check if "EAN_UPC" exists
-        print("Columns in Snowflake file:", df.columns.tolist())
-
-        # Ensure the expected columns exist
-        required_columns = {"ASIN", "EAN_UPC"}  # Ensure these exist
-        missing_columns = required_columns - set(df.columns)
-        if missing_columns:
-            return f"❌ Missing columns in Snowflake file: {', '.join(missing_columns)}"
-
-        # Drop rows where ASIN is NaN to avoid .str.lower() errors
-        df = df.dropna(subset=['ASIN'])
+        # Loaded once per workbook version, indexed by lowercased ASIN
+        table = reference_data.snowflake()
 
         # Perform case-insensitive lookup
-        result = df[df['ASIN'].str.lower() == asin.lower()]
+        row = table.first(str(asin).strip().lower())
 
-        if not result.empty:
-            return str(result.iloc[0]['EAN_UPC'])  # Convert to string for consistency
+        if row is not None:
+            return str(row['EAN_UPC'])  # Convert to string for consistency
         else:
             return f"⚠️ No EAN found for ASIN: {asin}"
 
+    except KeyError as e:
+        return f"❌ {e.args[0]}"
     except FileNotFoundError:
         return "❌ Error: Snowflake Excel file not found."
     except Exception as e:
@@ -124,40 +176,25 @@ def query_snowflake(asin: str):
 
 
 @tool("query_tipps")
+@track_tokens
 def query_tipps(ean: str):
     """
     Retrieves the promo discount associated with a given EAN from the TIPPS Excel file.
     """
 
-    file_path = "docs/events/tipps.xlsx"
-
     try:
-        # Load the Excel file safely
-        df = pd.read_excel(file_path, engine='openpyxl')
-
-        # Ensure required columns exist
-        required_columns = {"Consumer Unit EAN/UPC Code", "PROMO DISCOUNT £"}
-        missing_columns = required_columns - set(df.columns)
-        if missing_columns:
-            return f"❌ Missing columns in TIPPS file: {', '.join(missing_columns)}"
-
-        # Normalize the EAN column:
-        df['Consumer Unit EAN/UPC Code'] = (
-            df['Consumer Unit EAN/UPC Code']
-            .astype(str)   # Convert to string
-            .str.strip()   # Remove extra spaces
-            .str.replace(r'\.0$', '', regex=True)  # Remove .0 if it exists
-        )
+        # Loaded once per workbook version, indexed by normalized EAN
+        table = reference_data.tipps()
 
         # Normalize the input EAN
-        ean = str(ean).strip()
+        ean = reference_data.normalize_key(ean)
 
         # Perform exact match
-        result = df[df['Consumer Unit EAN/UPC Code'] == ean]
+        row = table.first(ean)
 
-        if not result.empty:
+        if row is not None:
             # Take the first valid promo discount
-            promo_discount = result.iloc[0]['PROMO DISCOUNT £']
+            promo_discount = row['PROMO DISCOUNT £']
 
             # Handle NaN values
             if pd.isna(promo_discount):
@@ -170,13 +207,99 @@ def query_tipps(ean: str):
         else:
             return f"No promo discount found for EAN: {ean}"
 
+    except KeyError as e:
+        return f"❌ {e.args[0]}"
     except FileNotFoundError:
         return "Error: TIPPS Excel file not found."
     except Exception as e:
         return f"Unexpected error: {str(e)}"
 
+
+NOT_FOUND = "NOT FOUND"
+MISSING = "MISSING"
+
+def _as_key_list(values):
+    """
+    Accepts a list of keys or a single string with keys separated by commas, spaces or new lines.
+    """
+    if isinstance(values, str):
+        values = values.replace(",", " ").split()
+    return [str(value).strip() for value in values if str(value).strip()]
+
+def _promo_discount(tipps_table, ean):
+    if ean is None:
+        return NOT_FOUND
+    row = tipps_table.first(ean)
+    if row is None:
+        return NOT_FOUND
+    promo_discount = row['PROMO DISCOUNT £']
+    if pd.isna(promo_discount):
+        return MISSING
+    return float(promo_discount)
+
+@tool("query_snowflake_batch")
+@track_tokens
+def query_snowflake_batch(asins: list):
+    """
+    Looks up all ASINs of an invoice in one call. For every ASIN it returns the EAN from the Snowflake
+    Excel file and the promo discount of that EAN from the TIPPS Excel file.
+
+    Parameters:
+    asins (list): The ASIN numbers to look up, e.g. ["B00ABC1234", "B00DEF5678"].
+
+    Returns:
+    Json (str): {"columns": ["asin", "ean", "promo_discount"], "rows": [[...], ...], "truncated": bool}, one row per ASIN.
+    "NOT FOUND" marks an ASIN without EAN or an EAN without TIPPS row, "MISSING" an empty promo discount.
+    At most 500 ASINs are answered per call; if truncated is true, call again with the remaining ASINs.
+    """
+    try:
+        snowflake_table = reference_data.snowflake()
+        tipps_table = reference_data.tipps()
+    except KeyError as e:
+        return f"❌ {e.args[0]}"
+    except FileNotFoundError as e:
+        return f"❌ Error: Excel file not found: {e.filename}"
+
+    asins = _as_key_list(asins)
+    rows = []
+    for asin in asins[:MAX_BATCH_ROWS]:
+        row = snowflake_table.first(asin.lower())
+        ean = row['EAN_UPC'] if row is not None else None
+        rows.append([asin, ean if ean is not None else NOT_FOUND, _promo_discount(tipps_table, ean)])
+
+    return _compact({"columns": ["asin", "ean", "promo_discount"], "rows": rows, "truncated": len(asins) > MAX_BATCH_ROWS})
+
+@tool("query_tipps_batch")
+@track_tokens
+def query_tipps_batch(eans: list):
+    """
+    Retrieves the promo discounts of several EAN codes from the TIPPS Excel file in one call.
+
+    Parameters:
+    eans (list): The EAN codes to look up.
+
+    Returns:
+    Json (str): {"columns": ["ean", "promo_discount"], "rows": [[...], ...], "truncated": bool}, one row per EAN.
+    "NOT FOUND" marks an EAN without TIPPS row, "MISSING" an empty promo discount.
+    At most 500 EANs are answered per call; if truncated is true, call again with the remaining EANs.
+    """
+    try:
+        tipps_table = reference_data.tipps()
+    except KeyError as e:
+        return f"❌ {e.args[0]}"
+    except FileNotFoundError:
+        return "Error: TIPPS Excel file not found."
+
+    eans = _as_key_list(eans)
+    rows = []
+    for ean in eans[:MAX_BATCH_ROWS]:
+        ean = reference_data.normalize_key(ean)
+        rows.append([ean, _promo_discount(tipps_table, ean)])
+
+    return _compact({"columns": ["ean", "promo_discount"], "rows": rows, "truncated": len(eans) > MAX_BATCH_ROWS})
     
 @tool("query_mapping_events")
+@track_tokens
 def query_mapping_events(invoice_data):
     """
     Extracts MDF number from the invoice data and retrieves
@@ -188,7 +311,8 @@ def query_mapping_events(invoice_data):
     
     Returns:
         dict: A dictionary containing the MDF number, Event Description,
-              and Event ID, or an error message if the MDF number is not found.
+              and Event ID, or an error message if the MDF number is not found,
+              with the closest Agreement IDs as ranked "candidates".
     """
     # Extract MDF number from invoice data
     mdf_number = invoice_data.get('mdf_number')
@@ -196,22 +320,54 @@ def query_mapping_events(invoice_data):
     if not mdf_number:
         return {"error": "MDF number not found in invoice data."}
 
-    # Load the mapping file
-    mapping_file_path = 'docs/events/mapping_events.xlsx'
+    # Load the mapping file (cached per workbook version)
     try:
-        mapping_df = pd.read_excel(mapping_file_path)
+        table = reference_data.mapping_events()
     except Exception as e:
         return {"error": f"Failed to read mapping file: {str(e)}"}
 
-    # Search for the MDF number in the mapping DataFrame
-    event_info = mapping_df.loc[mapping_df['Agreement ID'] == mdf_number]
+    # Search for the MDF number in the Agreement ID index
+    event_info = table.first(reference_data.normalize_key(mdf_number))
+
+    if event_info is None:
+        # Closest Agreement IDs (partial or misread number), best first, for the agent to confirm
+        candidates = [
+            {
+                "agreement_id": candidate["key"],
+                "match": candidate["match"],
+                "score": candidate["score"],
+                "event_description": reference_data.json_value(table.first(candidate["key"])["Event Description"]),
+                "event_id": reference_data.json_value(table.first(candidate["key"])["Event ID"]),
+            }
+            for candidate in table.id_index().search(mdf_number, MAX_TOOL_ROWS)
+        ]
+        return {"error": f"No mapping found for MDF number: {mdf_number}", "candidates": candidates}
 
-    if event_info.empty:
-        return {"error": f"No mapping found for MDF number: {mdf_number}"}
-
-    # Assuming the columns in the mapping file are named 'Event Description' and 'Event ID'
     return {
         "mdf_number": mdf_number,
-        "event_description": event_info['Event Description'].values[0],
-        "event_id": event_info['Event ID'].values[0]
-    }
\ No newline at end of file
+        "event_description": reference_data.json_value(event_info['Event Description']),
+        "event_id": reference_data.json_value(event_info['Event ID'])
+    }
+
+@tool("search_events_semantic")
+@track_tokens
+def search_events_semantic(description: str):
+    """
+    Fallback of query_mapping_events for when the MDF number finds no Agreement ID: searches the events mapping
+    Excel file by meaning, for a vendor wording of the event that differs from the sheet.
+
+    Parameters:
+    description (str): The event or promotion description from the invoice (e.g. "Prime Day deal fee").
+
+    Returns:
+    Json (str): {"matches": [{"agreement_id", "event_description", "event_id", "score"}]}, the 5 closest rows best first,
+    score being the similarity from 0 to 1. Check the best one against the invoice before using it; do not call again
+    with the same description.
+    """
+    try:
+        matches = semantic_index.get_semantic_index().query("mapping_events", description, MAX_TOOL_ROWS)
+    except FileNotFoundError:
+        return _compact({"error": "Mapping Events Excel file not found."})
+    except Exception as e:
+        return _compact({"error": f"Semantic search unavailable: {e}"})
+    return _compact({"matches": matches})
@@ -0,0 +1,335 @@
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+
+from crew import rate_limit
+
+TRACE_PATH = os.path.join("results", "traces.jsonl")
+SERVICE_NAME = "invoice-matching"
+# Finished invoices kept for the summary (the slowest ones), so a resident process stays bounded
+SLOWEST_KEPT = 100
+
+# Span name -> column of the per-invoice summary
+STAGES = {
+    "extract_pdf": "pdf",
+    "workbook.load": "excel",
+    "engine": "engine",
+    "tool": "tools",
+    "llm.call": "llm",
+    "crew.kickoff": "crew",
+}
+
+_current = contextvars.ContextVar("current_span", default=None)
+_collector = contextvars.ContextVar("span_collector", default=None)
+
+
+class Span:
+    """
+    One timed operation. Spans of the same invoice share a trace id and point to their parent,
+    with the field names of the OpenTelemetry span model.
+    """
+
+    def __init__(self, name: str, trace_id: str = None, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self, error: BaseException = None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        export(self.to_record())
+
+    def context(self) -> tuple:
+        """(trace id, span id), enough to continue the trace in another process."""
+        return self.trace_id, self.span_id
+
+    def to_record(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _any_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error else {"code": "STATUS_CODE_OK"},
+            "resource": {"service.name": SERVICE_NAME, "process.pid": os.getpid()},
+        }
+
+
+def _any_value(value) -> dict:
+    # OTLP/JSON AnyValue
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _from_any_value(value: dict):
+    if "intValue" in value:
+        return int(value["intValue"])
+    return next(iter(value.values()))
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name: str, parent: Span = None, **attributes) -> Span:
+    """
+    Starts a span without making it current (e.g. the root span of an invoice in a batch);
+    the caller ends it with span.end().
+    """
+    parent = parent or _current.get()
+    if parent is None:
+        return Span(name, attributes=attributes)
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block as a child of the current span: `with span("extract_pdf", file=path) as s: s.set(...)`.
+    """
+    current = start_span(name, **attributes)
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as exception:
+        error = exception
+        raise
+    finally:
+        _current.reset(token)
+        current.end(error)
+
+
+def set_attributes(**attributes):
+    """Sets attributes on the current span, if any (e.g. the cache hit of a lookup)."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def add_count(key: str, amount):
+    """Adds to a counter of the current span, if any (e.g. rows scanned by a tool)."""
+    current = _current.get()
+    if current is not None:
+        current.add(key, amount)
+
+
+def run_in_span(parent: Span, func, *args):
+    """
+    Runs func(*args) with parent as the current span, used by the batch worker threads.
+    """
+    token = _current.set(parent)
+    try:
+        return func(*args)
+    finally:
+        _current.reset(token)
+
+
+def run_traced(context: tuple, func, *args):
+    """
+    Runs func(*args) in a worker process as part of the trace given by context (see Span.context).
+    Returns (result, span records): the spans are exported by the parent process.
+    """
+    trace_id, span_id = context
+    parent = Span("remote", trace_id)
+    parent.span_id = span_id
+    records = []
+    span_token = _current.set(parent)
+    collector_token = _collector.set(records)
+    try:
+        return func(*args), records
+    finally:
+        _collector.reset(collector_token)
+        _current.reset(span_token)
+
+
+class Tracer:
+    """
+    Writes finished spans as JSON lines (OTLP/JSON span fields, one span per line) and keeps the
+    per-stage and per-invoice totals printed at the end of a batch.
+
+    Parameters:
+    path (str): JSONL file the spans are appended to, None to keep the totals only.
+    """
+
+    def __init__(self, path: str = TRACE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.stages = {}
+        self.invoices = {}
+        self.slowest = []
+
+    def export(self, record: dict):
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        with self.lock:
+            if self.path:
+                if self.file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self.file = open(self.path, "a", encoding="utf-8")
+                self.file.write(line + "\n")
+                self.file.flush()
+            self._aggregate(record)
+
+    def _aggregate(self, record: dict):
+        attributes = {item["key"]: _from_any_value(item["value"]) for item in record["attributes"]}
+        duration_ms = (int(record["endTimeUnixNano"]) - int(record["startTimeUnixNano"])) / 1e6
+        name = record["name"]
+
+        stats = self.stages.setdefault(name, {
+            "count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+            "input_tokens": 0, "output_tokens": 0, "cache_hits": 0, "cache_misses": 0, "rows_scanned": 0,
+        })
+        stats["count"] += 1
+        stats["errors"] += record["status"]["code"] == "STATUS_CODE_ERROR"
+        stats["total_ms"] += duration_ms
+        stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        stats["input_tokens"] += attributes.get("gen_ai.usage.input_tokens", 0)
+        stats["output_tokens"] += attributes.get("gen_ai.usage.output_tokens", 0)
+        stats["rows_scanned"] += attributes.get("rows_scanned", 0)
+        cache = attributes.get("cache")
+        if cache is not None:
+            stats["cache_hits" if cache == "hit" else "cache_misses"] += 1
+
+        invoice = self.invoices.setdefault(record["traceId"], {"invoice": None, "total_ms": 0.0, "llm_calls": 0, **{stage: 0.0 for stage in STAGES.values()}})
+        stage = STAGES.get(name) or STAGES.get(name.split(".")[0])
+        if stage is not None:
+            invoice[stage] += duration_ms
+        if name == "llm.call":
+            invoice["llm_calls"] += 1
+
+        # The root span ends after all its children: the trace is complete, only the slowest invoices are kept
+        if not record["parentSpanId"]:
+            del self.invoices[record["traceId"]]
+            if name == "invoice":
+                invoice["invoice"] = attributes.get("invoice")
+                invoice["total_ms"] = duration_ms
+                self.slowest.append(invoice)
+                self.slowest.sort(key=lambda invoice: -invoice["total_ms"])
+                del self.slowest[SLOWEST_KEPT:]
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "stages": {name: dict(stats) for name, stats in self.stages.items()},
+                "invoices": [dict(invoice) for invoice in self.slowest],
+            }
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Process-wide tracer writing to TRACE_PATH (results/traces.jsonl by default, empty to disable the file).
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(os.getenv("TRACE_PATH", TRACE_PATH) or None)
+        return _tracer
+
+
+def export(record: dict):
+    records = _collector.get()
+    if records is not None:
+        records.append(record)
+    else:
+        get_tracer().export(record)
+
+
+def export_records(records: list):
+    for record in records:
+        export(record)
+
+
+def traced_llm(llm):
+    """
+    Records every call of a CrewAI LLM as an "llm.call" span (estimated input/output tokens, and
+    the cache hit or miss set by crew.llm_cache.cached) and returns the same instance.
+    Applied last so it wraps the cache and the rate limiter.
+    """
+    call = llm.call
+
+    def traced_call(messages, *args, **kwargs):
+        parent = _current.get()
+        input_tokens = rate_limit.estimate_tokens(messages)
+        with span("llm.call", **{"gen_ai.request.model": llm.model, "gen_ai.usage.input_tokens": input_tokens}) as current:
+            result = call(messages, *args, **kwargs)
+            output_tokens = rate_limit.estimate_tokens(str(result))
+            current.set(**{"gen_ai.usage.output_tokens": output_tokens})
+        # The caller's span (e.g. crew.kickoff) totals the tokens of its model turns
+        if parent is not None:
+            parent.add("gen_ai.usage.input_tokens", input_tokens)
+            parent.add("gen_ai.usage.output_tokens", output_tokens)
+            parent.add("llm_calls", 1)
+        return result
+
+    object.__setattr__(llm, "call", traced_call)
+    return llm
+
+
+def kickoff(crew, inputs: dict):
+    """
+    crew.kickoff(inputs) inside a "crew.kickoff" span. Its tokens are the sum of its llm.call spans:
+    CrewAI's token_usage is cumulative over every kickoff sharing the LLM, so it is not used.
+    """
+    with span("crew.kickoff", agents=len(crew.agents), tasks=len(crew.tasks)):
+        return crew.kickoff(inputs=inputs)
+
+
+def format_trace_summary(slowest: int = 10) -> str:
+    """
+    Per-stage totals and the slowest invoices with the time spent in each stage, for the end of a batch.
+    """
+    summary = get_tracer().summary()
+    if not summary["stages"]:
+        return "No spans recorded."
+
+    lines = [f"{'span':<32}{'calls':>7}{'errors':>7}{'total ms':>11}{'avg ms':>9}{'max ms':>9}{'tok in':>9}{'tok out':>9}{'hit/miss':>10}{'rows':>9}"]
+    for name, stats in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_ms"]):
+        cache = f"{stats['cache_hits']}/{stats['cache_misses']}" if stats["cache_hits"] + stats["cache_misses"] else "-"
+        lines.append(
+            f"{name:<32}{stats['count']:>7}{stats['errors']:>7}{stats['total_ms']:>11.1f}{stats['total_ms'] / stats['count']:>9.1f}"
+            f"{stats['max_ms']:>9.1f}{stats['input_tokens']:>9}{stats['output_tokens']:>9}{cache:>10}{stats['rows_scanned']:>9}"
+        )
+
+    invoices = sorted(summary["invoices"], key=lambda invoice: -invoice["total_ms"])[:slowest]
+    if invoices:
+        lines.append("")
+        lines.append(f"{'invoice':<40}{'total ms':>10}" + "".join(f"{stage + ' ms':>10}" for stage in STAGES.values()) + f"{'llm calls':>11}")
+        for invoice in invoices:
+            name = os.path.basename(str(invoice["invoice"]))[:39]
+            lines.append(f"{name:<40}{invoice['total_ms']:>10.1f}" + "".join(f"{invoice[stage]:>10.1f}" for stage in STAGES.values()) + f"{invoice['llm_calls']:>11}")
+    return "\n".join(lines)
@@ -0,0 +1,12 @@
+import hashlib
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    Returns the sha256 of the file content, read in 1 MB blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
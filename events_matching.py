@@ -1,84 +1,139 @@
 import os
-import PyPDF2
-from crewai import Crew, Process, LLM
 
-from crew.agents import agent_business_analyst
-from crew.tasks import amazon_invoice_matching_event  # Import the new task
-from crew.tools import query_snowflake, query_tipps, query_mapping_events
+from crew import reference_data
+from crew.batch import run_batch, batch_concurrency
+from crew.crew_factory import CrewPool, event_crew
+from crew.ledger import Ledger
+from crew.models import EventReport, to_report
+from crew.llm import agent_llm
+from crew.llm_cache import get_llm_cache
+from crew.pdf import extract_pdf, iter_pages_parallel, page_count
+from crew.rate_limit import estimate_tokens
+from crew.telemetry import disable_crewai_telemetry
+from crew.token_report import format_tool_report
+from crew.tracing import format_trace_summary, span
 
 from dotenv import load_dotenv
 load_dotenv()
 
 class Agent():
-    def __init__(self):
-        deployment = os.getenv("AZURE_DEPLOYMENT")
-        kenvue_endpoint =  os.getenv("AZURE_ENDPOINT")
-        api_version = os.getenv("OPENAI_API_VERSION")
-        api_key = os.getenv("API_KEY")
-    
-        self.llm = LLM(
-            model=f"azure/{deployment}",
-            base_url=f"{kenvue_endpoint}/openai/deployments/{deployment}/chat/completions?api-version={api_version}",
-            api_key=api_key
-        )
+    def __init__(self, llm=None):
+        """
+        Parameters:
+        llm (LLM): CrewAI LLM to use instead of the Azure deployment from the .env file (e.g. the benchmark stub).
+        """
+        # Cached, rate-limited and traced Azure deployment (crew/llm.py)
+        self.llm = agent_llm(llm)
+
+        # Agent, tools and task are built once per concurrent invoice and reused (crew/crew_factory.py)
+        self.crews = CrewPool(event_crew, self.llm, batch_concurrency())
       
     def run_event_analysis(self, inputs):
-        senior_business_analyst = agent_business_analyst(self.llm, [query_snowflake, query_tipps, query_mapping_events])
-        task_amazon_invoice_matching_event = amazon_invoice_matching_event(senior_business_analyst)
-        
-        crew = Crew(
-            agents=[senior_business_analyst],
-            tasks=[task_amazon_invoice_matching_event],
-            process=Process.sequential,
-            verbose=True,
-            output_log_file="crew.log"
-        )
-       
-        result = crew.kickoff(inputs=inputs)
+        result = self.crews.kickoff(inputs)
         return result
-     
-def disable_crewai_telemetry():
-    """
-        This is a fix to remove the telemetry validation, it's not necessary as it only 
-        send notification to help the CrewAI team to enhance the library performance
-    """
-    from crewai.telemetry import Telemetry
-    def noop(*args, **kwargs):
-        pass
-    for attr in dir(Telemetry):
-        if callable(getattr(Telemetry, attr)) and not attr.startswith("__"):
-            setattr(Telemetry, attr, noop)
-
-def extract_pdf(file_path: str):
-    with open(file_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        text = ""
-        
-        # Extract text from each page
-        for page_num in range(len(reader.pages)):
-            page = reader.pages[page_num]
-            text += page.extract_text()
-
-    return text
 
+    def run_event_report(self, invoice: str) -> dict:
+        """
+        Runs the event crew and returns its validated report as a dict
+        (invalid answers are repaired with one short LLM call, see crew/models.py).
+        """
+        return to_report(self.run_event_analysis({"invoice": invoice}), EventReport, self.llm).model_dump(mode="json")
+
+    def run_event_llm(self, invoice: str) -> dict:
+        """
+        Runs the event crew on the invoice text. Invoices longer than EVENT_CHUNK_TOKENS are split into
+        line-item chunks matched concurrently and merged into one report (see crew/chunking.py).
+        """
+        max_tokens = int(os.getenv("EVENT_CHUNK_TOKENS", "6000"))
+        if estimate_tokens(invoice) <= max_tokens:
+            return self.run_event_report(invoice)
+
+        from crew.chunking import run_chunked
+
+        return run_chunked(
+            invoice,
+            self.run_event_report,
+            max_tokens=max_tokens,
+            concurrency=batch_concurrency()
+        )
+
+    def match(self, invoice: str) -> EventReport:
+        """
+        Matches an event invoice with the deterministic engine and only calls the crew for the
+        lines the parser could not read (or for the whole invoice when no line was parsed).
+        """
+        return self.match_pages([invoice], invoice)
+
+    def match_pdf(self, file_path: str, mp_context=None):
+        """
+        Same as match for very large PDFs: pages are extracted by several processes and matched
+        as they arrive, without building the whole invoice text first.
+        mp_context is the multiprocessing context of those processes (spawn from a multi-threaded process).
+        """
+        return self.match_pages(iter_pages_parallel(file_path, mp_context=mp_context), None)
+
+    def match_pages(self, pages, invoice):
+        from crew.events_engine import match_event_pages, merge_fallback
+
+        tolerance = float(os.getenv("EVENT_MATCH_TOLERANCE", "0.01"))
+        report, fallback_text = match_event_pages(pages, tolerance)
+
+        if not report["invoice_data"]:
+            report = self.run_event_llm(invoice if invoice is not None else fallback_text)
+        elif report["unparsed_lines"]:
+            report = merge_fallback(report, self.run_event_llm(fallback_text))
+
+        return EventReport.model_validate(report)
+     
 if __name__ == '__main__':
     disable_crewai_telemetry()
 
     # Analyze events
     event_files = os.listdir("docs/events/")
-    event_pdf_files = [file for file in event_files if file.lower().endswith('.pdf')]
+    event_pdf_files = [f"docs/events/{file}" for file in event_files if file.lower().endswith('.pdf')]
     
+    # Only new, changed or failed invoices are processed; each result is saved as soon as it is ready
+    ledger = Ledger("events")
+    version = reference_data.reference_version(reference_data.EVENT_PATHS)
+    pending = ledger.pending(event_pdf_files, version)
+    print(f"{len(pending)} of {len(event_pdf_files)} event invoices to process")
+    if not pending:
+        raise SystemExit(0)
+
+    # One Agent (and LLM client) shared by every invoice, only loaded when there is something to match
+    agent = Agent()
+
+    # Very large invoices are streamed page by page, the rest go through the concurrent batch
+    large_pdf_pages = int(os.getenv("LARGE_PDF_PAGES", "50"))
+    large_pdf_files = [file for file in pending if page_count(file) >= large_pdf_pages]
+    event_pdf_files = [file for file in pending if file not in large_pdf_files]
+
+    # Invoices are extracted and matched concurrently (BATCH_CONCURRENCY), results arrive as they finish
     event_result_list = []
-    for pdf_file in event_pdf_files: 
-        invoice = extract_pdf(f"docs/events/{pdf_file}")
-        print(f"Processing event invoice: {pdf_file}")  # Debugging
+    for pdf_file, report, error in run_batch(event_pdf_files, extract_pdf, agent.match):
+        ledger.record(pdf_file, pending[pdf_file], version, report.model_dump(mode="json") if error is None else None, error)
+        if error is not None:
+            print(f"Error processing event invoice {pdf_file}: {error}")
+            continue
+        print(f"Processed event invoice: {pdf_file}")
+        event_result_list.append(report.model_dump_json(indent=2))
 
-        # Create a new Agent instance for each file
-        agent = Agent()
-        result = agent.run_event_analysis({"invoice": invoice})
-        
-        event_result_list.append(result.raw)
+    for pdf_file in large_pdf_files:
+        print(f"Processing large event invoice: {pdf_file}")
+        try:
+            with span("invoice", invoice=pdf_file):
+                report = agent.match_pdf(pdf_file)
+        except Exception as error:
+            ledger.record(pdf_file, pending[pdf_file], version, None, error)
+            print(f"Error processing event invoice {pdf_file}: {error}")
+            continue
+        ledger.record(pdf_file, pending[pdf_file], version, report.model_dump(mode="json"))
+        event_result_list.append(report.model_dump_json(indent=2))
 
     print("\n\n####### EVENT RESULTS #######\n")
     for r in event_result_list:
         print(r)
+
+    print(f"\nLLM cache: {get_llm_cache().stats()}")
+    print(f"\nTool output tokens:\n{format_tool_report()}")
+    print(f"\nTrace summary (spans in results/traces.jsonl):\n{format_trace_summary()}")
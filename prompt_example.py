@@ -1,10 +1,17 @@
 import os
-import PyPDF2
-import pandas as pd
+import asyncio
 
 from langchain_openai import AzureChatOpenAI
+from langchain_core.messages import AIMessage
 from langchain_core.prompts import PromptTemplate
 
+from crew import reference_data
+from crew.llm_cache import get_llm_cache
+from crew.models import InvoiceFields
+from crew.pdf import extract_pdf
+from crew.rate_limit import get_rate_limiter, estimate_tokens
+from crew.tracing import span, format_trace_summary
+
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -18,126 +25,150 @@ class AmazonInvoiceMatching:
             temperature=temperature,
             max_retries=max_retries
         )
-        
-    def __extract_pdf(self, file_path: str):
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ""
-            
-            # Extract text from each page
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                text += page.extract_text()
-        return text
-
-    def __extract_xlsx(self, file_path: str):
-        df = pd.read_excel(file_path, engine='openpyxl')
-        data = df.to_dict(orient='records')  # Convert the DataFrame to a dictionary
-        
-        return data
     
-    def __invoke_prompt(self, prompt, mapping):
+    async def __invoke_prompt(self, prompt, mapping, llm=None):
         prompt_template = PromptTemplate.from_template(f"{prompt}")
             
-        chain = prompt_template | self.llm
-        return chain.invoke(mapping)
+        chain = prompt_template | (llm or self.llm)
+        rendered = prompt_template.format(**mapping)
+        
+        input_tokens = estimate_tokens(rendered)
+        with span("llm.call", **{"gen_ai.request.model": self.llm.deployment_name, "gen_ai.usage.input_tokens": input_tokens}) as current:
+            # Unchanged prompts are answered from the persistent cache (see crew/llm_cache.py)
+            cache = get_llm_cache()
+            key = cache.make_key(self.llm.deployment_name, self.llm.temperature, rendered, schema=self.__schema_name(llm))
+            value = cache.get(key)
+            current.set(cache="miss" if value is None else "hit")
+            if value is None:
+                # Respect the deployment RPM/TPM budget and back off on 429 (see crew/rate_limit.py)
+                result = await get_rate_limiter().arun(lambda: chain.ainvoke(mapping), input_tokens)
+                value = result.model_dump_json() if isinstance(result, InvoiceFields) else result.content
+                cache.set(key, value)
+            else:
+                result = self.__from_cache(value, llm)
+            current.set(**{"gen_ai.usage.output_tokens": estimate_tokens(value)})
+        return result
+
+    def __schema_name(self, llm):
+        return InvoiceFields.__name__ if llm is not None else None
+
+    def __from_cache(self, value, llm):
+        if llm is not None:
+            return InvoiceFields.model_validate_json(value)
+        return AIMessage(content=value)
+
+    def __mapping_row(self, mapping_path: str, mdf_number):
+        """Only the mapping row of the MDF number is sent to the model, not the whole sheet."""
+        if not mdf_number:
+            return "No MDF number found in the invoice."
+        row = reference_data.mapping(mapping_path).first(reference_data.normalize_key(mdf_number))
+        if row is None:
+            return f"No row found in the rebate sheet for MDF number {mdf_number}."
+        return row.to_dict()
+
+    def __net_receipts_cell(self, net_receipts_path: str, month, category):
+        """Only the net receipts cell at (month, category) is sent to the model, not the whole sheet."""
+        row = reference_data.net_receipts(net_receipts_path).first(str(month).strip().lower())
+        if row is None or category not in row.index:
+            return f"No net receipts value found for month {month} and category {category}."
+        return dict(zip(["Month", category], row[["Month", category]].tolist()))
 
     def match(self, invoice_path: str, mapping_path: str, net_receipts_path: str):
-        invoice = self.__extract_pdf(file_path=invoice_path)
-        mapping = self.__extract_xlsx(file_path=mapping_path)
-        net_receipts = self.__extract_xlsx(file_path=net_receipts_path)
+        with span("invoice", invoice=invoice_path):
+            return asyncio.run(self.amatch(invoice_path, mapping_path, net_receipts_path))
+
+    async def amatch(self, invoice_path: str, mapping_path: str, net_receipts_path: str):
+        """
+        Runs the prompt chain as a dependency graph:
+            1. one structured call extracts percentage, total, month, MDF and invoice number (former prompts 01, 02 and 07)
+            2. prompts 03 and 04 run concurrently on the matching mapping row and net receipts cell
+            3. prompt 05 calculates the rebate value
+            4. prompt 06 compares the rebate value with the invoice total
+            5. the final summary lists the values and the match status of prompt 06
+        """
+        invoice = extract_pdf(file_path=invoice_path)
         
         # Prompt to the model
-        prompt_01 = self.__invoke_prompt(
-            prompt = """
-                {invoice}
-                Look under the "line description" column of the table of the pdf. Does any row under the "Line Description" column contain a percentage? 
-                If yes, then output the percentage number.
-            """,
-            mapping = { "invoice": f"{invoice}" }
-        )
-        
-        prompt_02 = self.__invoke_prompt(
+        fields = await self.__invoke_prompt(
             prompt = """
                 {invoice}
-                Extract the following: 
-                1. Invoice total
-                2. The month from the net receipts period.
-                3. The MDF number.
+                Extract the following from the invoice above:
+                1. Look under the "line description" column of the table of the pdf. If any row under the "Line Description" column contains a percentage, the percentage number.
+                2. Invoice total
+                3. The month from the net receipts period.
+                4. The MDF number.
+                5. The invoice number, it's to the right of "Invoice Number", "Numero Fattura" or similar depending on the language of the invoice.
             """,
-            mapping = { "invoice": f"{invoice}" }
+            mapping = { "invoice": f"{invoice}" },
+            llm = self.llm.with_structured_output(InvoiceFields)
         )
+        extraction = fields.model_dump_json()
         
-        prompt_03 = self.__invoke_prompt(
-            prompt = """
-                {mapping}
-                In the rebate sheet, use the MDF number referenced in {prompt_02} and search for it on column I. 
-                On what row do you find a match? What is the corresponding value in column A for that row? Assign this value as the "Rebate Name".
-                What is the corresponding value in column C? Assign this value as the Category.
-            """,
-            mapping = { "mapping": f"{mapping}", "prompt_02": f"{prompt_02}" }
-        )
+        mapping_row = self.__mapping_row(mapping_path, fields.mdf_number)
+        category = mapping_row.get("Category") if isinstance(mapping_row, dict) else None
+        net_receipt_cell = self.__net_receipts_cell(net_receipts_path, fields.invoice_month, category)
         
-        prompt_04 = self.__invoke_prompt(
-            prompt = """
-                Use the month identified in {prompt_02} and the category identified in {prompt_03} 
-                and extract the value from {net_receipts} that is found at the intersection of the corresponding row and column. Assign this value as the "Net Receipt"
-            """,
-            mapping = { "net_receipts": f"{net_receipts}", "prompt_03": f"{prompt_03}", "prompt_02": f"{prompt_02}" }
+        prompt_03, prompt_04 = await asyncio.gather(
+            self.__invoke_prompt(
+                prompt = """
+                    Rebate sheet row: {mapping_row}
+                    This is the row of the rebate sheet whose MDF number (column I) matches the MDF number in {extraction}.
+                    What is the value in column A (Rebates)? Assign this value as the "Rebate Name".
+                    What is the value in column C (Category)? Assign this value as the Category.
+                """,
+                mapping = { "mapping_row": f"{mapping_row}", "extraction": extraction }
+            ),
+            self.__invoke_prompt(
+                prompt = """
+                    Net receipts: {net_receipt_cell}
+                    This is the value of the net receipts sheet at the intersection of the month in {extraction} and the category {category}.
+                    Assign this value as the "Net Receipt"
+                """,
+                mapping = { "net_receipt_cell": f"{net_receipt_cell}", "extraction": extraction, "category": f"{category}" }
+            )
         )
         
-        prompt_05 = self.__invoke_prompt(
+        prompt_05 = await self.__invoke_prompt(
             prompt = """
-                {net_receipts}
                 Do the following math: 
-                X = Y * Z
-                "Y" is the percentage value identified in {prompt_01}
+                X = Y / 100 * Z
+                "Y" is the percentage value identified in {extraction}, as written (2.5 for 2.5%)
                 "Z" is the Net Receipt identified in {prompt_04} 
                 Calculate X and assign the value of X as "Rebate Value".
                 
                 Explain your reasoning
             """,
             mapping = { 
-                "net_receipts": f"{net_receipts}", 
-                "prompt_01": f"{prompt_01}",
-                "prompt_04": f"{prompt_04}"
+                "extraction": extraction,
+                "prompt_04": f"{prompt_04.content}"
             }
         )
         
-        prompt_06 = self.__invoke_prompt(
+        prompt_06 = await self.__invoke_prompt(
             prompt = """
-                Compare the rebate value from {prompt_05} to the invoice total from {prompt_02}. 
+                Compare the rebate value from {prompt_05} to the invoice total from {extraction}. 
                 If the invoice total is lower than the rebate value, then output that the invoice is partially matched. 
                 If it's higher, output that the invoice is not matched. If its plus or minus 500 GBP difference, output that it's fully matched.
             """,
             mapping = { 
-                "prompt_05": f"{prompt_05}",
-                "prompt_02": f"{prompt_02}"
+                "prompt_05": f"{prompt_05.content}",
+                "extraction": extraction
             }
         )
-        
-        prompt_07 = self.__invoke_prompt(
-            prompt = """
-                From {invoice} extract the invoice number it's to the right of "Invoice Number", "Numero Fattura" or similar depending on the language of the invoice).
-            """,
-            mapping = { "invoice": f"{invoice}" }
-        )
-        
-        result = self.__invoke_prompt(
+
+        result = await self.__invoke_prompt(
             prompt = """
                 List the following values:
-                - Invoice number (from {prompt_07})
-                - MDF number (from {prompt_01})
-                - Invoice total and Invoice month (from {invoice} it's the month from the net receipts period)
+                - Invoice number, MDF number, Invoice total and Invoice month (from {extraction})
                 - Rebate name and Category (from {prompt_03})
                 - Rebate value (from {prompt_05})
+                - Match status (from {prompt_06})
             """,
             mapping = {
-                "prompt_07": f"{prompt_07}",
-                "prompt_01": f"{prompt_01}",
-                "invoice": f"{invoice}",
-                "prompt_03": f"{prompt_03}",
-                "prompt_05": f"{prompt_05}",
+                "extraction": extraction,
+                "prompt_03": f"{prompt_03.content}",
+                "prompt_05": f"{prompt_05.content}",
+                "prompt_06": f"{prompt_06.content}",
             }
         )
         return result  
@@ -164,4 +195,7 @@ if __name__ == '__main__':
         )
         print(f"##### {pdf_file} #####")
         print(result.content)
-        print(f"\n")
\ No newline at end of file
+        print(f"\n")
+    
+    print(f"LLM cache: {get_llm_cache().stats()}")
+    print(f"\nTrace summary (spans in results/traces.jsonl):\n{format_trace_summary()}")
\ No newline at end of file
@@ -1,80 +1,85 @@
 import os
-import PyPDF2
-from crewai import Crew, Process, LLM
 
-from crew.agents import agent_business_analyst
-from crew.tasks import amazon_invoice_matching_rebate
-from crew.tools import query_mapping, query_net_receipts, calculate_rebate_value
+from crew import reference_data
+from crew.batch import run_batch, batch_concurrency
+from crew.crew_factory import CrewPool, rebate_crew
+from crew.ledger import Ledger
+from crew.models import RebateReport, to_report
+from crew.llm import agent_llm
+from crew.llm_cache import get_llm_cache
+from crew.pdf import extract_pdf
+from crew.telemetry import disable_crewai_telemetry
+from crew.token_report import format_tool_report
+from crew.tracing import format_trace_summary
 
 
 from dotenv import load_dotenv
 load_dotenv()
 
 class Agent():
-    def __init__(self):
-        deployment = os.getenv("AZURE_DEPLOYMENT")
-        kenvue_endpoint =  os.getenv("AZURE_ENDPOINT")
-        api_version = os.getenv("OPENAI_API_VERSION")
-        api_key = os.getenv("API_KEY")
-    
-        self.llm = LLM(
-            model=f"azure/{deployment}",
-            base_url=f"{kenvue_endpoint}/openai/deployments/{deployment}/chat/completions?api-version={api_version}",
-            api_key=api_key
-        )
+    def __init__(self, llm=None):
+        """
+        Parameters:
+        llm (LLM): CrewAI LLM to use instead of the Azure deployment from the .env file (e.g. the benchmark stub).
+        """
+        # Cached, rate-limited and traced Azure deployment (crew/llm.py)
+        self.llm = agent_llm(llm)
+
+        # Agent, tools and task are built once per concurrent invoice and reused (crew/crew_factory.py)
+        self.crews = CrewPool(rebate_crew, self.llm, batch_concurrency())
       
     def run(self, inputs):
-        senior_business_analyst = agent_business_analyst(self.llm, [query_mapping, query_net_receipts, calculate_rebate_value])
-        task_amazon_invoice_matching_rebate = amazon_invoice_matching_rebate(senior_business_analyst)
-        
-        crew = Crew(
-            agents=[senior_business_analyst],
-            tasks=[task_amazon_invoice_matching_rebate],
-            process=Process.sequential,
-            verbose=True,
-            output_log_file="crew.log"
-        )
-       
-        result = crew.kickoff(inputs=inputs)
+        result = self.crews.kickoff(inputs)
         return result
-     
-def disable_crewai_telemetry():
-    """
-        This is a fix to remove the telemetry validation, it's not necessary as it only 
-        send notification to help the CrewAI team to enhance the library performance
-    """
-    from crewai.telemetry import Telemetry
-    def noop(*args, **kwargs):
-        pass
-    for attr in dir(Telemetry):
-        if callable(getattr(Telemetry, attr)) and not attr.startswith("__"):
-            setattr(Telemetry, attr, noop)
 
-def extract_pdf(file_path: str):
-    with open(file_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        text = ""
-        
-        # Extract text from each page
-        for page_num in range(len(reader.pages)):
-            page = reader.pages[page_num]
-            text += page.extract_text()
+    def match(self, invoice: str) -> RebateReport:
+        """
+        Extracts the invoice fields (vendor templates, one LLM call only for low-confidence fields) and calculates,
+        validates and classifies the rebate in code (see crew/rebate_engine.py).
+        The crew only runs when the MDF number or the net receipt cannot be resolved.
+        """
+        from crew.rebate_engine import extract_fields, match_rebate_invoice
 
-    return text
+        tolerance = float(os.getenv("REBATE_MATCH_TOLERANCE", "500"))
+        min_confidence = float(os.getenv("EXTRACTION_MIN_CONFIDENCE", "0.8"))
+        report = match_rebate_invoice(extract_fields(invoice, self.llm, min_confidence), tolerance)
+        if report.rebate_value is not None:
+            return report
 
+        # Invalid crew answers are repaired with one short LLM call, see crew/models.py
+        return to_report(self.run({"invoice": invoice}), RebateReport, self.llm)
+     
 if __name__ == '__main__':
     disable_crewai_telemetry()
-    agent = Agent()
     
     files = os.listdir("docs/rebates/")
-    pdf_files = [file for file in files if file.endswith('.pdf')]
+    pdf_files = [f"docs/rebates/{file}" for file in files if file.endswith('.pdf')]
     
+    # Only new, changed or failed invoices are processed; each result is saved as soon as it is ready
+    ledger = Ledger("rebates")
+    version = reference_data.reference_version(reference_data.REBATE_PATHS)
+    pending = ledger.pending(pdf_files, version)
+    print(f"{len(pending)} of {len(pdf_files)} rebate invoices to process")
+    if not pending:
+        raise SystemExit(0)
+
+    # The LLM client and the engines are only loaded when there is something to match
+    agent = Agent()
+    
+    # Invoices are extracted and matched concurrently (BATCH_CONCURRENCY), results arrive as they finish
     result_list = []
-    for pdf_file in pdf_files: 
-        invoice = extract_pdf(f"docs/rebates/{pdf_file}")
-        result = agent.run({"invoice":f"{invoice}"})
-        result_list.append(result.raw)
+    for pdf_file, report, error in run_batch(pending, extract_pdf, agent.match):
+        ledger.record(pdf_file, pending[pdf_file], version, report.model_dump(mode="json") if error is None else None, error)
+        if error is not None:
+            print(f"Error processing {pdf_file}: {error}")
+            continue
+        print(f"Processed rebate invoice: {pdf_file}")
+        result_list.append(report.model_dump_json(indent=2))
     
     print("\n\n####### RESULTS #######\n")
     for r in result_list:
-        print(r)
\ No newline at end of file
+        print(r)
+
+    print(f"\nLLM cache: {get_llm_cache().stats()}")
+    print(f"\nTool output tokens:\n{format_tool_report()}")
+    print(f"\nTrace summary (spans in results/traces.jsonl):\n{format_trace_summary()}")
@@ -0,0 +1,91 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from crew.models import InvoiceFields
+from crew.pdf import extract_pdf
+from crew.rebate_engine import DEFAULT_TOLERANCE, RECONCILIATION_COLUMNS, extract_fields, reconcile_rebates
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Column names accepted in the input table, besides the InvoiceFields names themselves
+FIELD_ALIASES = {
+    "mdf": "mdf_number",
+    "mdf number": "mdf_number",
+    "percent": "percentage",
+    "%": "percentage",
+    "month": "invoice_month",
+    "total": "invoice_total",
+    "invoice total": "invoice_total",
+    "invoice number": "invoice_number",
+}
+
+
+def read_table(path: str) -> pd.DataFrame:
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    if extension in (".xlsx", ".xls"):
+        return pd.read_excel(path)
+    return pd.read_csv(path, dtype={"mdf_number": str, "invoice_number": str})
+
+
+def write_table(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.lower().endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    return df.rename(columns=lambda column: FIELD_ALIASES.get(str(column).strip().lower(), str(column).strip()))
+
+
+def extract_invoice_fields(file_path: str) -> dict:
+    """
+    Invoice fields of one PDF from the vendor templates only (no LLM call); fields the templates
+    cannot read are left empty and the invoice comes out as Not Matched.
+    """
+    fields = extract_fields(extract_pdf(file_path)).model_dump()
+    fields["file"] = file_path
+    return fields
+
+
+def fields_from_pdfs(folder: str, workers: int = None) -> pd.DataFrame:
+    pdf_files = sorted(os.path.join(folder, file) for file in os.listdir(folder) if file.lower().endswith(".pdf"))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(extract_invoice_fields, pdf_files, chunksize=16))
+    return pd.DataFrame(rows, columns=list(InvoiceFields.model_fields) + ["file"])
+
+
+def reconcile(fields: pd.DataFrame, tolerance: float) -> pd.DataFrame:
+    report = reconcile_rebates(normalize_columns(fields), tolerance)
+    # Report columns first, then whatever else the input table carried (file, vendor...)
+    extra = [column for column in report.columns if column not in RECONCILIATION_COLUMNS]
+    return report[RECONCILIATION_COLUMNS + extra]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reconciles a whole batch of rebate invoices against the mapping and net receipts in one pass")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--fields", help="CSV, Parquet or Excel table with mdf_number, percentage, invoice_month, invoice_total (and invoice_number)")
+    source.add_argument("--pdfs", help="Folder of rebate invoice PDFs, fields read with the vendor templates")
+    parser.add_argument("--output", default=os.path.join("results", "rebates_reconciliation.csv"), help="Report path, .csv or .parquet")
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("REBATE_MATCH_TOLERANCE", DEFAULT_TOLERANCE)))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    fields = read_table(args.fields) if args.fields else fields_from_pdfs(args.pdfs)
+    loaded = time.perf_counter()
+    report = reconcile(fields, args.tolerance)
+    matched = time.perf_counter()
+    write_table(report, args.output)
+
+    print(f"{len(report)} invoices reconciled in {matched - loaded:.2f}s (input read in {loaded - start:.2f}s)")
+    print(report["match_status"].value_counts().to_string())
+    print(f"Report saved to {args.output}")
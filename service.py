@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from watchfiles import awatch
+
+import events_matching
+import rebates_matching
+from crew import reference_data, snapshot, tracing
+from crew.batch import batch_concurrency
+from crew.ledger import Ledger
+from crew.pdf import extract_pdf, page_count
+from crew.telemetry import disable_crewai_telemetry
+from crew.utils import file_sha256
+
+from dotenv import load_dotenv
+load_dotenv()
+
+KINDS = {
+    "rebates": ("docs/rebates", reference_data.REBATE_PATHS),
+    "events": ("docs/events", reference_data.EVENT_PATHS),
+}
+UPLOAD_DIR = os.path.join(".cache", "uploads")
+
+
+def _watch_filter(change, path: str) -> bool:
+    # Source documents only: no snapshots written by the service itself, no Excel lock files
+    name = os.path.basename(path)
+    return (name.lower().endswith((".pdf", ".xlsx"))
+            and snapshot.SNAPSHOT_DIR not in path.split(os.sep)
+            and not name.startswith("~$"))
+
+
+class MatchingService:
+    """
+    Resident matcher: the LLM clients, agents, reference workbooks and worker pools are created once
+    and shared by every invoice, so a request only pays for the matching itself.
+
+    Parameters:
+    concurrency (int): Invoices matched at the same time, BATCH_CONCURRENCY by default.
+    agents (dict): {"rebates": Agent, "events": Agent}, built from the .env file by default.
+    """
+
+    def __init__(self, concurrency: int = None, agents: dict = None):
+        disable_crewai_telemetry()
+        self.concurrency = concurrency or batch_concurrency()
+        self.agents = agents or {"rebates": rebates_matching.Agent(), "events": events_matching.Agent()}
+        self.ledgers = {kind: Ledger(kind) for kind in KINDS}
+        self.large_pdf_pages = int(os.getenv("LARGE_PDF_PAGES", "50"))
+
+        # The service runs threads, so extraction workers are spawned rather than forked,
+        # and they are started now rather than on the first invoice
+        workers = min(self.concurrency, os.cpu_count() or 1)
+        self.mp_context = multiprocessing.get_context("spawn")
+        self.extract_pool = ProcessPoolExecutor(max_workers=workers, mp_context=self.mp_context)
+        list(self.extract_pool.map(abs, range(workers)))
+        self.match_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.versions = {}
+        self.reload_workbooks()
+
+    def reload_workbooks(self) -> dict:
+        """
+        Rebuilds the snapshots of changed workbooks and loads every table into memory, so the next
+        invoice does not pay for it. Returns the reference version of each kind.
+        """
+        with tracing.span("workbooks.reload"):
+            snapshot.compile_snapshots([folder for folder, _ in KINDS.values()])
+            for loader in (reference_data.mapping, reference_data.net_receipts, reference_data.snowflake,
+                           reference_data.tipps, reference_data.mapping_events):
+                try:
+                    loader()
+                except FileNotFoundError:
+                    pass
+        self.versions = {kind: reference_data.reference_version(paths) for kind, (_, paths) in KINDS.items()}
+        return dict(self.versions)
+
+    async def reload_when_ready(self, attempts: int = 5, delay: float = 1.0):
+        """
+        Reloads the workbooks after a change. A workbook that is still being saved cannot be read
+        yet, so the reload is retried; the previous tables stay in use until it succeeds.
+        """
+        for attempt in range(attempts):
+            try:
+                versions = await asyncio.to_thread(self.reload_workbooks)
+            except Exception as error:
+                if attempt == attempts - 1:
+                    print(json.dumps({"event": "workbooks reload failed", "error": repr(error)}), flush=True)
+                    return
+                await asyncio.sleep(delay)
+                continue
+            print(json.dumps({"event": "workbooks reloaded", "versions": versions}), flush=True)
+            return
+
+    def _is_large(self, kind: str, path: str) -> bool:
+        # Very large event invoices are streamed page by page by match_pdf instead of extracted up front
+        return kind == "events" and page_count(path) >= self.large_pdf_pages
+
+    async def match_file(self, kind: str, path: str, force: bool = False) -> dict:
+        """
+        Extracts and matches one PDF, records it in the ledger and returns
+        {"file", "kind", "result", "error", "cached"}. An invoice already matched with the same
+        content and reference data is answered from the ledger unless force is set.
+        Hashing the file and reading or syncing the ledger run in threads, never on the event loop.
+        """
+        sha256 = await asyncio.to_thread(file_sha256, path)
+        version = self.versions[kind]
+        previous = await asyncio.to_thread(self.ledgers[kind].last, path)
+        if (not force and previous is not None and previous["status"] == "done"
+                and previous["sha256"] == sha256 and previous["reference_version"] == version):
+            return {"file": path, "kind": kind, "result": previous["output"], "error": None, "cached": True}
+
+        loop = asyncio.get_running_loop()
+        root = tracing.start_span("invoice", invoice=path, kind=kind)
+        report = None
+        error = None
+        try:
+            if await loop.run_in_executor(self.match_pool, self._is_large, kind, path):
+                report = await loop.run_in_executor(self.match_pool, tracing.run_in_span, root, self.agents[kind].match_pdf, path, self.mp_context)
+            else:
+                text, records = await loop.run_in_executor(self.extract_pool, tracing.run_traced, root.context(), extract_pdf, path)
+                tracing.export_records(records)
+                report = await loop.run_in_executor(self.match_pool, tracing.run_in_span, root, self.agents[kind].match, text)
+        except Exception as exception:
+            error = exception
+        finally:
+            root.end(error)
+
+        output = report.model_dump(mode="json") if report is not None else None
+        await asyncio.to_thread(self.ledgers[kind].record, path, sha256, version, output, error)
+        return {"file": path, "kind": kind, "result": output, "error": repr(error) if error is not None else None, "cached": False}
+
+    async def match_files(self, kind: str, paths, force: bool = False):
+        """
+        Matches the PDFs concurrently and yields each result as soon as it is ready.
+        """
+        tasks = [asyncio.ensure_future(self.match_file(kind, path, force)) for path in paths]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def process_pending(self, kind: str):
+        """
+        Matches the new, changed or failed PDFs of the kind's docs folder (see Ledger.pending).
+        """
+        folder, _ = KINDS[kind]
+        pdf_files = [os.path.join(folder, file) for file in sorted(os.listdir(folder)) if file.lower().endswith(".pdf")]
+        pending = await asyncio.to_thread(self.ledgers[kind].pending, pdf_files, self.versions[kind])
+        async for result in self.match_files(kind, pending, force=True):
+            status = "error" if result["error"] else "done"
+            print(json.dumps({"file": result["file"], "kind": kind, "status": status, "error": result["error"]}), flush=True)
+
+    async def watch(self, process_pdfs: bool = True):
+        """
+        Watches the docs folders: changed workbooks are reloaded at once and, when process_pdfs is set,
+        new or changed invoices are matched as they land (invoices of a kind whose workbooks changed are
+        matched again, as in the batch scripts). Raises FileNotFoundError when no docs folder exists.
+        """
+        folders = [folder for folder, _ in KINDS.values() if os.path.isdir(folder)]
+        if not folders:
+            raise FileNotFoundError(f"None of the docs folders exists: {', '.join(folder for folder, _ in KINDS.values())}")
+        if process_pdfs:
+            for kind in KINDS:
+                if os.path.isdir(KINDS[kind][0]):
+                    await self.process_pending(kind)
+
+        async for changes in awatch(*folders, watch_filter=_watch_filter):
+            paths = [path for _, path in changes]
+            if any(path.lower().endswith(".xlsx") for path in paths):
+                await self.reload_when_ready()
+            if process_pdfs:
+                for kind, (folder, _) in KINDS.items():
+                    if any(os.path.abspath(path).startswith(os.path.abspath(folder) + os.sep) for path in paths):
+                        await self.process_pending(kind)
+
+    def close(self):
+        self.extract_pool.shutdown(cancel_futures=True)
+        self.match_pool.shutdown(cancel_futures=True)
+        tracing.get_tracer().close()
+
+
+def _log_watch_end(task: asyncio.Task):
+    # The watcher runs next to the API, nothing awaits it: a failure would otherwise go unnoticed
+    if not task.cancelled() and task.exception() is not None:
+        print(json.dumps({"event": "watcher stopped", "error": repr(task.exception())}), flush=True)
+
+
+def save_upload(folder: str, content: bytes) -> str:
+    """
+    Stores an uploaded PDF under the sha256 of its content and returns the path. Concurrent requests
+    and same-named files never overwrite each other, and the ledger entry follows the content, not
+    the upload name (the file is written to a unique temporary name first, then moved in place).
+    """
+    path = os.path.join(folder, hashlib.sha256(content).hexdigest() + ".pdf")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    return path
+
+
+def create_app(watch_pdfs: bool = False, service_factory=MatchingService) -> FastAPI:
+    """
+    HTTP API of the service. The workbooks are always hot-reloaded; with watch_pdfs the docs folders
+    are also processed like in the directory-watch mode.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        service = await asyncio.to_thread(service_factory)
+        app.state.service = service
+        watcher = asyncio.create_task(service.watch(process_pdfs=watch_pdfs))
+        watcher.add_done_callback(_log_watch_end)
+        try:
+            yield
+        finally:
+            watcher.cancel()
+            service.close()
+
+    app = FastAPI(title="Agent invoice matching", lifespan=lifespan)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "reference_versions": app.state.service.versions}
+
+    @app.post("/reload")
+    async def reload():
+        return {"reference_versions": await asyncio.to_thread(app.state.service.reload_workbooks)}
+
+    @app.post("/match/{kind}")
+    async def match(kind: str, files: List[UploadFile] = File(...), force: bool = False):
+        """
+        Matches the uploaded PDFs and streams one json line per invoice as soon as it is matched
+        ("file" is the upload name; identical files are matched once).
+        """
+        if kind not in KINDS:
+            raise HTTPException(status_code=404, detail=f"Unknown invoice kind {kind!r}, expected one of {sorted(KINDS)}")
+
+        folder = os.path.join(UPLOAD_DIR, kind)
+        os.makedirs(folder, exist_ok=True)
+        names = {}
+        for upload in files:
+            path = await asyncio.to_thread(save_upload, folder, await upload.read())
+            names.setdefault(path, os.path.basename(upload.filename or "invoice.pdf"))
+
+        async def results():
+            async for result in app.state.service.match_files(kind, list(names), force):
+                result["file"] = names[result["file"]]
+                yield json.dumps(result, default=str) + "\n"
+
+        return StreamingResponse(results(), media_type="application/x-ndjson")
+
+    return app
+
+
+async def watch_only():
+    service = await asyncio.to_thread(MatchingService)
+    try:
+        await service.watch(process_pdfs=True)
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Resident invoice matching service")
+    parser.add_argument("--host", default=os.getenv("SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVICE_PORT", "8000")))
+    parser.add_argument("--watch", action="store_true", help="Also match the PDFs dropped in docs/rebates and docs/events")
+    parser.add_argument("--watch-only", action="store_true", help="Directory-watch mode without the HTTP API")
+    args = parser.parse_args()
+
+    if args.watch_only:
+        try:
+            asyncio.run(watch_only())
+        except KeyboardInterrupt:
+            pass
+    else:
+        uvicorn.run(create_app(watch_pdfs=args.watch), host=args.host, port=args.port)